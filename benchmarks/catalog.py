@@ -0,0 +1,163 @@
+"""Synthetic MOVIES databases for benchmarks, built from OMDb like records.
+Titles are unique, people, languages and genres are drawn with a skew so
+that some are in many movies, award strings come in the formats OMDb uses.
+
+    python -m benchmarks.catalog [rows]
+"""
+import os
+import random
+import sys
+import time
+import movies.db.query as query
+from movies.db.dbm import DatabaseManager
+from movies.loader import FETCH_COLUMNS, load_rows
+
+SIZES = (1000, 100000, 1000000)
+
+DATA_DIR = "benchmarks/data"
+
+ADJECTIVES = [
+    "Silent", "Broken", "Last", "Golden", "Hidden", "Dark", "Lost", "Wild", "Quiet",
+    "Burning", "Frozen", "Crimson", "Hollow", "Final", "Forgotten", "Electric", "Bitter",
+    "Distant", "Endless", "Savage", "Secret", "Shattered", "Velvet", "Iron", "Midnight",
+]
+
+NOUNS = [
+    "River", "Kingdom", "Stranger", "Harbor", "Empire", "Garden", "Witness", "Horizon",
+    "Promise", "Shadow", "Voyage", "Summer", "Signal", "Mountain", "Letter", "Circus",
+    "Island", "Station", "Mirror", "Frontier", "Orchard", "Verdict", "Carnival", "Tide",
+    "Republic", "Border", "Covenant", "Highway", "Orbit", "Lighthouse",
+]
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+    "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica",
+    "Thomas", "Sarah", "Charles", "Karen", "Akira", "Ingrid", "Pedro", "Agnieszka",
+    "Jean", "Sophia", "Hiro", "Lena", "Marco", "Olga", "Kenji", "Amara", "Luis", "Freya",
+]
+
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor",
+    "Moore", "Jackson", "Martin", "Lee", "Thompson", "White", "Harris", "Kurosawa",
+    "Bergman", "Almodovar", "Kowalski", "Truffaut", "Fellini", "Tarkovsky", "Nakamura",
+    "Schmidt", "Rossi", "Dubois", "Novak", "Larsen", "Okafor", "Silva", "Petrov",
+]
+
+GENRES = [
+    "Drama", "Comedy", "Thriller", "Action", "Romance", "Crime", "Horror", "Adventure",
+    "Sci-Fi", "Mystery", "Fantasy", "Biography", "Animation", "Family", "History",
+    "War", "Music", "Documentary", "Western", "Sport",
+]
+
+LANGUAGES = [
+    "English", "French", "Spanish", "German", "Italian", "Japanese", "Polish",
+    "Russian", "Mandarin", "Korean", "Hindi", "Portuguese", "Swedish", "Arabic",
+]
+
+COUNTRIES = [
+    "USA", "UK", "France", "Germany", "Italy", "Japan", "Poland", "Spain", "Canada",
+    "South Korea", "India", "Brazil", "Sweden", "Australia",
+]
+
+
+def person(i):
+    """Distinct name for every index, with middle initials once plain names run out."""
+    first, rest = FIRST_NAMES[i % len(FIRST_NAMES)], i // len(FIRST_NAMES)
+    last, rest = LAST_NAMES[rest % len(LAST_NAMES)], rest // len(LAST_NAMES)
+    initials = []
+    while rest:
+        rest, letter = divmod(rest - 1, 26)
+        initials.insert(0, f"{chr(65 + letter)}.")
+    return " ".join([first, *initials, last])
+
+
+def title(i):
+    combos = len(ADJECTIVES) * len(NOUNS)
+    name = f"{ADJECTIVES[i % len(ADJECTIVES)]} {NOUNS[i // len(ADJECTIVES) % len(NOUNS)]}"
+    return name if i < combos else f"{name} {i // combos + 1}"
+
+
+def awards(rng):
+    wins, nominations = int(rng.paretovariate(1.2)) - 1, int(rng.paretovariate(1)) - 1
+    nominations += wins
+    if not nominations:
+        return "N/A"
+    counts = f"{wins} win{'s' * (wins != 1)} & {nominations} nomination{'s' * (nominations != 1)}"
+    oscars = rng.random()
+    if oscars < 0.03:
+        return f"Won {rng.randint(1, 11)} Oscars. Another {counts}."
+    if oscars < 0.1:
+        return f"Nominated for {rng.randint(1, 8)} Oscars. Another {counts}."
+    return f"{counts}."
+
+
+def names(rng, pool, count, draw):
+    """Count distinct names of a pool, popular ones drawn more often."""
+    return ", ".join(dict.fromkeys(draw(int(pool * rng.random() ** 3)) for _ in range(count)))
+
+
+def movie(i, rng, people):
+    """OMDb record of the i-th synthetic movie."""
+    return {
+        "Title": title(i),
+        "Year": str(rng.randint(1920, 2024)),
+        "Runtime": f"{rng.randint(70, 200)} min" if rng.random() > 0.02 else "N/A",
+        "Genre": names(rng, len(GENRES), rng.randint(1, 3), GENRES.__getitem__),
+        "Director": names(rng, max(people // 8, 1), rng.choice((1, 1, 1, 2)), person),
+        "Actors": names(rng, people, 4, person),
+        "Writer": names(rng, max(people // 4, 1), rng.randint(1, 3), person),
+        "Language": names(rng, len(LANGUAGES), rng.randint(1, 3), LANGUAGES.__getitem__),
+        "Country": names(rng, len(COUNTRIES), rng.randint(1, 2), COUNTRIES.__getitem__),
+        "Awards": awards(rng),
+        "imdbRating": f"{min(max(rng.gauss(6.5, 1.1), 1), 10):.1f}",
+        "imdbVotes": f"{int(rng.paretovariate(0.8) * 100):,}",
+        "BoxOffice": f"${int(rng.paretovariate(1) * 500000):,}" if rng.random() > 0.4 else "N/A",
+        "imdbID": f"tt{i:07d}",
+        "Response": "True",
+    }
+
+
+def records(rows, seed=0, start=0):
+    """Records of movies start to start + rows, later ones have other titles."""
+    rng = random.Random(seed + start)
+    people = max((start + rows) // 2, 10)
+    return (movie(i, rng, people) for i in range(start, start + rows))
+
+
+def generate(filepath, rows, seed=0):
+    """Write a catalog of rows movies to a new database file, return its manager."""
+    for path in (filepath, f"{filepath}-wal", f"{filepath}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    open(filepath, "w").close()
+    db_api = DatabaseManager(db_fp=filepath)
+    data = load_rows(records(rows, seed), set(), time.time())
+    db_api.bulk_insert(query.insert(*FETCH_COLUMNS), data)
+    db_api.set_meta("populated", 1)
+    db_api.set_meta("catalog", f"{rows}:{seed}")
+    return db_api
+
+
+def catalog(rows, seed=0, data_dir=DATA_DIR):
+    """Path of a catalog file, generated once and reused by later runs."""
+    filepath = os.path.join(data_dir, f"catalog_{rows}.sqlite")
+    if os.path.exists(filepath):
+        db_api = DatabaseManager(db_fp=filepath)
+        stale = db_api.meta("catalog") != f"{rows}:{seed}"
+        db_api.close()
+        if not stale:
+            return filepath
+    os.makedirs(data_dir, exist_ok=True)
+    generate(filepath, rows, seed).close()
+    return filepath
+
+
+def main(*sizes):
+    for rows in sizes or SIZES:
+        start = time.perf_counter()
+        print(catalog(rows), f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""Compare two benchmark runs, saved as JSON lines, by their fastest runs.
+Exits with 1 if any benchmark got slower than threshold times its time before,
+changes under MIN_DELTA seconds are taken for noise.
+
+    python -m benchmarks.compare before.jsonl after.jsonl [threshold]
+"""
+import json
+import sys
+
+THRESHOLD = 1.2
+MIN_DELTA = 0.001
+
+
+def read(filepath):
+    """Fastest times by benchmark name and catalog size."""
+    with open(filepath, encoding="utf-8") as f:
+        results = (json.loads(line) for line in f if line.strip())
+        return {
+            (result["benchmark"], result.get("rows")): result["min_s"]
+            for result in results
+            if "min_s" in result
+        }
+
+
+def compare(before, after, threshold=THRESHOLD):
+    """Rows of name, rows, time before and after, ratio and whether it regressed."""
+    results = []
+    for (name, rows), old in before.items():
+        new = after.get((name, rows))
+        if new is None or not old:
+            continue
+        slower = new > old * threshold and new - old > MIN_DELTA
+        results.append((name, rows, old, new, new / old, slower))
+    return results
+
+
+def main(before_fp, after_fp, threshold=THRESHOLD):
+    rows = compare(read(before_fp), read(after_fp), float(threshold))
+    for name, size, before, after, ratio, slower in rows:
+        flag = "  SLOWER" if slower else ""
+        print(f"{name:40} {size!s:>8} {before:10.5f}s {after:10.5f}s {ratio:6.2f}x{flag}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:4]))
@@ -0,0 +1,201 @@
+"""Timings of Commander commands, SQLite functions, DataPrinter.fold and
+Requester.request_many on a synthetic catalog, printed as JSON lines so
+runs of different commits can be compared.
+
+    python -m benchmarks.hot_paths [rows] [runs]
+    python -m benchmarks.compare before.jsonl after.jsonl
+"""
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import count, islice
+import movies.db.query as query
+import movies.requester as req
+from movies.db.dbm import DatabaseManager
+from movies.utils import Commander, DataPrinter
+from tests.stub import StubOMDb
+from benchmarks import catalog
+
+# Function: arguments it's called with over every row
+UDF_ARGS = {
+    "str": "YEAR",
+    "float": "IMDb_Rating",
+    "_int": "YEAR",
+    "_str": "YEAR",
+    "_float": "IMDb_Rating",
+    "int": "YEAR",
+    "nominations": "AWARDS",
+    "awards_won": "AWARDS",
+    "won_80_nom": "AWARDS",
+    "osc_won": "AWARDS",
+    "osc_nom": "AWARDS",
+    "has_person": "\"CAST\", 'James Smith'",
+    "has_language": "LANGUAGE, 'Polish'",
+    "clnstr": "RUNTIME",
+    "tform": "RUNTIME",
+    "int_to_account": "BOX_OFFICE",
+    "int_to_comas": "IMDb_votes",
+    "has_osc_nom": "AWARDS",
+    "name_key": "TITLE",
+}
+
+FOLD_ROWS = 1000
+REQUESTS = 200
+ADD_BATCH = 50
+IMPORT_ROWS = 1000
+
+
+def time_call(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_commands(cmd, rows):
+    """Query modes, values are picked so that they match movies of any catalog size."""
+    first, second = catalog.title(0), catalog.title(rows // 2)
+    director, actor = catalog.person(0), catalog.person(1)
+    commands = {
+        "sort_by.year": lambda: cmd.sort_by("year"),
+        "sort_by.runtime": lambda: cmd.sort_by("runtime"),
+        "sort_by.rating_votes": lambda: cmd.sort_by("rating", "votes"),
+        "filter_by.director": lambda: cmd.filter_by(["director", director]),
+        "filter_by.people": lambda: cmd.filter_by(["people", director, actor]),
+        "filter_by.genre": lambda: cmd.filter_by(["genre", "Drama"]),
+        "filter_by.language": lambda: cmd.filter_by(["language", "Polish"]),
+        "filter_by.eighty": lambda: cmd.filter_by(["eighty"]),
+        "filter_by.boxoffice": lambda: cmd.filter_by(["boxoffice"]),
+        "compare.imdb": lambda: cmd.compare("imdb", first, second),
+        "compare.misspelled": lambda: cmd.compare("runtime", first[1:], second),
+        "highscores.1": lambda: cmd.highscores(1),
+        "highscores.10": lambda: cmd.highscores(10),
+        "search.title": lambda: cmd.search("silent", "river"),
+        "search.person": lambda: cmd.search("kurosawa"),
+        "stats.decade": lambda: cmd.stats("decade"),
+        "stats.director": lambda: cmd.stats("director", 3),
+    }
+    if importlib.util.find_spec("numpy"):
+        commands.update({
+            "percentiles.boxoffice": lambda: cmd.percentiles("boxoffice", 50, 90, 99),
+            "histogram.year": lambda: cmd.histogram("year", 10),
+        })
+    return commands
+
+
+def write_commands(cmd, rows, tmp_dir):
+    """Modes that add movies, every call adds ones not added before."""
+    new = count(rows)
+
+    def take(n):
+        return [catalog.title(next(new)) for _ in range(n)]
+
+    def import_file():
+        filepath = os.path.join(tmp_dir, "import.jsonl")
+        with open(filepath, "w", encoding="utf-8") as f:
+            for record in catalog.records(IMPORT_ROWS, start=next(new) + 10 ** 7):
+                f.write(json.dumps(record) + "\n")
+        return cmd.import_movies(filepath)
+
+    return {
+        "add_movie": lambda: cmd.add_movie(take(1)[0]),
+        "add_movies": lambda: cmd.add_movies(take(ADD_BATCH)),
+        "import_movies": import_file,
+        "refresh": cmd.refresh,
+    }
+
+
+def udf_queries():
+    return {
+        func: f"SELECT COUNT({func}({args})) FROM MOVIES;" for func, args in UDF_ARGS.items()
+    }
+
+
+def fold_tables():
+    """Query, columns and terminal width. Narrow rows fit the terminal, wide
+    ones are folded. Widths are fixed, so the layout doesn't depend on the
+    terminal of the run."""
+    return {
+        "narrow": (query.sort("year", "runtime"), ["Title", "Year", "Runtime"], 120),
+        "wide": (query.sort("actors"), ["Title", "Actors"], 60),
+    }
+
+
+def run(filepath, rows, runs):
+    """Yield a result of every benchmark."""
+    cmd = Commander(output="records", query_cache_fp=None)
+    cmd._db_api = DatabaseManager(db_fp=filepath, readonly=True)
+    for name, func in read_commands(cmd, rows).items():
+        yield f"commander.{name}", time_call(func, runs)
+
+    for name, sql in udf_queries().items():
+        yield f"udf.{name}", time_call(lambda: cmd.db_api.select_one(sql), runs)
+
+    printer = DataPrinter(interactive=False)
+    for name, (sql, cols, width) in fold_tables().items():
+        printer.terminal_width = width
+        data = list(islice(cmd.db_api.iter_select(sql), FOLD_ROWS))
+        yield f"printer.fold.{name}", time_call(lambda: printer.fold(data, cols), runs)
+    cmd.db_api.close()
+
+    needed = REQUESTS + runs * (ADD_BATCH + 1)
+    stub = StubOMDb(catalog.records(needed, start=rows))
+    site = stub.start()
+    try:
+        requester = req.Requester("key", site=site)
+        titles = [catalog.title(i) for i in range(rows, rows + REQUESTS)]
+        yield "requester.request_many", time_call(lambda: requester.request_many(titles), runs)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            copy = os.path.join(tmp_dir, "catalog.sqlite")
+            shutil.copy(filepath, copy)
+            writer = Commander(query_cache_fp=None)
+            writer._db_api = DatabaseManager(db_fp=copy)
+            # Downloader checks the api key online when it's made, the stub takes any key.
+            writer._downloader = req.Downloader.__new__(req.Downloader)
+            writer._downloader.req = req.Requester("key", site=site)
+            for name, func in write_commands(writer, rows + REQUESTS, tmp_dir).items():
+                yield f"commander.{name}", time_call(func, runs)
+            writer.db_api.close()
+    finally:
+        stub.stop()
+
+
+def main(rows=1000, runs=5):
+    filepath = catalog.catalog(rows)
+    sha = commit()
+    for name, timings in run(filepath, rows, runs):
+        print(
+            json.dumps(
+                {
+                    "benchmark": name,
+                    "rows": rows,
+                    "runs": runs,
+                    "median_s": statistics.median(timings),
+                    "min_s": min(timings),
+                    "commit": sha,
+                }
+            ),
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
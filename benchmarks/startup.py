@@ -0,0 +1,57 @@
+"""Startup time of the CLI, printed as JSON lines so runs can be compared.
+
+    python -m benchmarks.startup [runs]
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "import_utils": [sys.executable, "-c", "import movies.utils"],
+    "commander": [sys.executable, "-c", "from movies.utils import Commander; Commander()"],
+    "cli_help": [sys.executable, "movies.py", "--help"],
+}
+
+HEAVY_MODULES = ["requests", "concurrent.futures", "urllib3"]
+
+PROBE = "import sys, movies.utils; print(' '.join(m for m in {} if m in sys.modules))"
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def heavy_imports():
+    """Modules CLI startup should not pay for, imported by movies.utils."""
+    probe = PROBE.format(HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True
+    ).stdout
+    return output.split()
+
+
+def main(runs=10):
+    for name, command in COMMANDS.items():
+        timings = time_command(command, runs)
+        print(
+            json.dumps(
+                {
+                    "benchmark": f"startup.{name}",
+                    "runs": runs,
+                    "median_s": statistics.median(timings),
+                    "min_s": min(timings),
+                }
+            )
+        )
+    print(json.dumps({"benchmark": "startup.heavy_imports", "modules": heavy_imports()}))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
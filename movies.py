@@ -1,6 +1,18 @@
 import sys
 import argparse
 from movies.utils import Commander as cmd
+from movies.conf import (
+    WORKERS,
+    POOL_SIZE,
+    TIMEOUT,
+    CACHE_FP,
+    QUERY_CACHE_FP,
+    REFRESH_AGE,
+    SERVER_PORT,
+)
+from movies.export import FORMATS
+
+DAY = 24 * 60 * 60
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="A db api statistics script.")
@@ -14,7 +26,7 @@ if __name__ == "__main__":
     mode.add_argument(
         "--filter_by",
         metavar="str",
-        help= "Filters data by a category. [ Director ] / --filter_by director <full name> / [ Actor ] / --filter_by actor <full name> / [ Movies that were nominated for Oscar but did not win any ] / --filter_by oscar_nom / [ Movies that won more than 80%% of nominations / --filter_by eighty / [ Only movies in certain language ] / --filter_by language <language> / [ Movies that earned more than $100,000,000 ] / --filter_by boxoffice /",
+        help= "Filters data by a category. [ Director ] / --filter_by director <full name> / [ Actor ] / --filter_by actor <full name> / [ Writer ] / --filter_by writer <full name> / [ Movies featuring all of the people ] / --filter_by people <full name> <full name> ... / [ Movies that were nominated for Oscar but did not win any ] / --filter_by oscar_nom / [ Movies that won more than 80%% of nominations / --filter_by eighty / or another ratio / --filter_by eighty 0.9 / [ Only movies in certain language ] / --filter_by language <language> / [ Only movies from certain country ] / --filter_by country <country> / [ Only movies of certain genre ] / --filter_by genre <genre> / [ Movies that earned more than $100,000,000 ] / --filter_by boxoffice /",
         nargs="+",
     )
     mode.add_argument(
@@ -26,32 +38,166 @@ if __name__ == "__main__":
     mode.add_argument(
         "--add",
         metavar="str",
-        help="[ Add a movie to a database. ] / --add movie_title /",
+        help="[ Add movies to a database, by titles or IMDb ids. ] / --add movie_title / --add movie_title tt0111161 movie_title /",
+        nargs="+",
+    )
+    mode.add_argument(
+        "--add_file",
+        metavar="path",
+        help="[ Add movies listed in a file, one title or IMDb id per line. ] / --add_file titles.txt /",
+    )
+    mode.add_argument(
+        "--import",
+        dest="import_fp",
+        metavar="path",
+        help="[ Load movies from a local file of OMDb records, JSON list or JSON Lines (.jsonl) ] / --import movies.jsonl /",
+    )
+    mode.add_argument(
+        "--refresh",
+        metavar="days",
+        help="[ Download again movies fetched more than 30 days ago or missing data ] / --refresh / [ Or fetched more than given number of days ago ] / --refresh 7 /",
         nargs="?",
+        const=REFRESH_AGE / DAY,
+        type=float,
     )
     mode.add_argument(
         "--highscores",
-        help="[ Provide a list of highscores in runtime, box office, awards won, nominations, oscars won, IMDB rating ] / --highscores /",
+        metavar="int",
+        help="[ Provide a list of highscores in runtime, box office, awards won, nominations, oscars won, IMDB rating ] / --highscores / [ Top places in every category ] / --highscores 10 /",
+        nargs="?",
+        const=1,
+        type=int,
+    )
+    mode.add_argument(
+        "--search",
+        metavar="str",
+        help="[ Movies with all the words in title, cast, director, writer, genre or awards, best matches first ] / --search nolan thriller / [ Words ending with * match prefixes ] / --search godf* /",
+        nargs="+",
+    )
+    mode.add_argument(
+        "--stats",
+        metavar="str",
+        help="[ Number of movies, mean IMDb rating, total box office and best rated movie per group: year, decade, director, actor, writer, genre, language, country ] / --stats decade / [ Only groups with at least 3 movies ] / --stats director 3 /",
+        nargs="+",
+    )
+    mode.add_argument(
+        "--percentiles",
+        metavar="str",
+        help="[ Percentiles of a numeric column: year, runtime, rating, votes, boxoffice, awards, nominations, oscars, oscars_nom, needs NumPy ] / --percentiles runtime / --percentiles boxoffice 50 90 99 /",
+        nargs="+",
+    )
+    mode.add_argument(
+        "--histogram",
+        metavar="str",
+        help="[ Number of movies in equal ranges of a numeric column, needs NumPy ] / --histogram year / --histogram rating 20 /",
+        nargs="+",
+    )
+    mode.add_argument(
+        "--serve",
+        metavar="port",
+        help=f"[ Serve sort_by, filter_by, compare, highscores and add as JSON over HTTP from one warm process ] / --serve / [ On another port than {SERVER_PORT} ] / --serve 8000 /",
+        nargs="?",
+        const=SERVER_PORT,
+        type=int,
+    )
+    parser.add_argument(
+        "--analytics",
+        help="Run sort_by and highscores on a NumPy snapshot of numeric columns. Sorting works by title and numeric columns only.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="int",
+        help="Number of concurrent downloads.",
+        type=int,
+        default=WORKERS,
+    )
+    parser.add_argument(
+        "--pool_size",
+        metavar="int",
+        help="Number of kept-alive connections to OMDb.",
+        type=int,
+        default=POOL_SIZE,
+    )
+    parser.add_argument(
+        "--timeout",
+        metavar="float",
+        help="Seconds to wait for OMDb response.",
+        type=float,
+        default=TIMEOUT,
+    )
+    parser.add_argument(
+        "--no_cache",
+        help="Download from OMDb even if a response is cached, and run queries even if their results are cached.",
         action="store_true",
     )
+    parser.add_argument(
+        "--output",
+        help="[ Write sort_by, filter_by, compare or highscores results in machine-readable format instead of a table ] / --sort_by year --output csv /",
+        choices=FORMATS,
+    )
+    parser.add_argument(
+        "--file",
+        metavar="path",
+        help="[ Write --output results to a file instead of stdout ] / --output jsonl --file movies.jsonl /",
+    )
     args = parser.parse_args()
+    if args.histogram and len(args.histogram) > 2:
+        parser.error("argument --histogram: expected a column and at most a number of bins")
+    settings = {
+        "workers": args.workers,
+        "pool_size": args.pool_size,
+        "timeout": args.timeout,
+        "cache_fp": None if args.no_cache else CACHE_FP,
+        "query_cache_fp": None if args.no_cache else QUERY_CACHE_FP,
+        "analytics": args.analytics,
+        "output": args.output,
+        "output_fp": args.file,
+    }
+    # Exported rows go to stdout, so messages must not be mixed with them.
+    out = sys.stderr if args.output else sys.stdout
 
     if args.sort_by:
-        print(cmd().sort_by(*args.sort_by))
+        print(cmd(**settings, readonly=True).sort_by(*args.sort_by), file=out)
         sys.exit(1)
     elif args.filter_by:
-        print(cmd().filter_by(args.filter_by))
+        print(cmd(**settings, readonly=True).filter_by(args.filter_by), file=out)
         sys.exit(1)
 
     elif args.compare:
-        print(cmd().compare(*args.compare))
+        print(cmd(**settings, readonly=True).compare(*args.compare), file=out)
         sys.exit(1)
     elif args.add:
-        print(cmd().add_movie(args.add))
+        print(cmd(**settings).add_movies(args.add))
+        sys.exit(1)
+    elif args.add_file:
+        print(cmd(**settings).add_file(args.add_file))
+        sys.exit(1)
+    elif args.import_fp:
+        print(cmd(**settings).import_movies(args.import_fp))
+        sys.exit(1)
+    elif args.refresh is not None:
+        print(cmd(**settings).refresh(args.refresh * DAY))
         sys.exit(1)
-    elif args.highscores:
-        print(cmd().highscores())
+    elif args.highscores is not None:
+        print(cmd(**settings, readonly=True).highscores(args.highscores), file=out)
         sys.exit(1)
+    elif args.search:
+        print(cmd(**settings, readonly=True).search(*args.search), file=out)
+        sys.exit(1)
+    elif args.stats:
+        print(cmd(**settings, readonly=True).stats(*args.stats[:2]), file=out)
+        sys.exit(1)
+    elif args.percentiles:
+        print(cmd(**settings, readonly=True).percentiles(*args.percentiles), file=out)
+        sys.exit(1)
+    elif args.histogram:
+        print(cmd(**settings, readonly=True).histogram(*args.histogram), file=out)
+        sys.exit(1)
+    elif args.serve is not None:
+        from movies.server import serve
+
+        serve(port=args.serve, **settings)
     else:
         print("Please choose mode to run in.")
         sys.exit(1)
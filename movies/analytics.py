@@ -0,0 +1,148 @@
+"""Columnar snapshot of numeric movie columns, for vectorized analytics.
+NumPy is optional, it's imported only when a snapshot is made.
+"""
+import movies.db.query as query
+from movies.db.sqlite_extensions import FUNCMAP
+
+# Column name: (SQL expression, integral values)
+COLUMNS = {
+    "year": ("YEAR", True),
+    "runtime": ("clnstr(RUNTIME)", True),
+    "rating": ("IMDB_RATING", False),
+    "votes": ("IMDB_VOTES", True),
+    "boxoffice": ("BOX_OFFICE", True),
+    "awards": ("AWARDS_WON", True),
+    "nominations": ("NOMINATIONS", True),
+    "oscars": ("OSCARS_WON", True),
+    "oscars_nom": ("OSCARS_NOM", True),
+}
+
+# Formatting of sorted columns, as in query.SORT
+FORMATS = {
+    "year": "_str",
+    "runtime": "tform",
+    "rating": "_str",
+    "votes": "int_to_comas",
+    "boxoffice": "int_to_account",
+    "awards": "_str",
+}
+
+BY_EXPR = {expr.upper(): name for name, (expr, _) in COLUMNS.items()}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("Analytics need NumPy, install it with: pip install numpy")
+    return numpy
+
+
+def _number(value):
+    """Values that aren't numbers count as missing."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return float("nan")
+
+
+class Snapshot:
+    """Numeric columns of all movies as arrays, ordered by ID, with a title index."""
+
+    def __init__(self, ids, titles, columns, version=None):
+        self.np = _numpy()
+        self.ids = ids
+        self.titles = titles
+        self.columns = columns
+        self.version = version
+
+    @classmethod
+    def load(cls, db_api):
+        np = _numpy()
+        exprs = [expr for expr, _ in COLUMNS.values()]
+        version = db_api.data_version()
+        rows = db_api.select_one(query.snapshot(*exprs))
+        values = list(zip(*rows)) or [()] * (len(exprs) + 2)
+        columns = {
+            name: np.array([_number(v) for v in col], dtype=float)
+            for name, col in zip(COLUMNS, values[2:])
+        }
+        ids = np.array(values[0], dtype=np.int64)
+        titles = np.array(values[1], dtype=object)
+        return cls(ids, titles, columns, version)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise ValueError(
+                f"No numeric column: {name}. Choose from: {', '.join(COLUMNS)}."
+            )
+
+    def value(self, name, number):
+        """Number as SQLite would return it, None if missing."""
+        if number != number:
+            return None
+        return int(number) if COLUMNS[name][1] else float(number)
+
+    def highscores(self, top=1, raw=False):
+        """Same rows as query.highscores(raw): top places of every category, ties included."""
+        np = self.np
+        data = []
+        for label, (func, key) in query.HIGHSCORES.items():
+            name = BY_EXPR[key.upper()]
+            values = self.columns[name]
+            positive = np.flatnonzero(values > 0)
+            order = positive[np.lexsort((self.ids[positive], -values[positive]))]
+            ranked = -values[order]
+            ranks = np.searchsorted(ranked, ranked, side="left") + 1
+            conv = (lambda value: value) if raw else FUNCMAP[func][1]
+            data.extend(
+                (label, self.titles[i], conv(self.value(name, values[i])))
+                for i in order[ranks <= top]
+            )
+        return data
+
+    def sort(self, *args, raw=False):
+        """Same rows as query.sort(*args, raw), for title and numeric columns."""
+        np = self.np
+        keys = [self.ids]
+        for arg in reversed(args):
+            if arg == "title":
+                codes = np.unique(self.titles, return_inverse=True)[1]
+                keys.append(-codes.ravel())
+            elif arg in FORMATS:
+                # Descending with missing values last, like NULLs in SQLite.
+                keys.append(np.where(np.isnan(self.columns[arg]), np.inf, -self.columns[arg]))
+            else:
+                raise ValueError(f"Analytics can't sort by: {arg}.")
+        cols = [arg for arg in args if arg != "title"]
+        formats = [FUNCMAP[FORMATS[col]][1] for col in cols]
+        data = []
+        for i in np.lexsort(keys):
+            row = [self.titles[i]]
+            for col, func in zip(cols, formats):
+                value = self.value(col, self.columns[col][i])
+                if not raw:
+                    value = func(value)
+                    value = "N/A" if value is None else value
+                row.append(value)
+            data.append(tuple(row))
+        return data
+
+    def percentiles(self, name, percents):
+        values = self.column(name)
+        values = values[~self.np.isnan(values)]
+        if not len(values):
+            return []
+        return list(zip(percents, self.np.percentile(values, percents).tolist()))
+
+    def histogram(self, name, bins):
+        values = self.column(name)
+        values = values[~self.np.isnan(values)]
+        if not len(values):
+            return []
+        counts, edges = self.np.histogram(values, bins)
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist(), counts.tolist()))
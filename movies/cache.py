@@ -0,0 +1,124 @@
+import hashlib
+import json
+import sqlite3 as sq3
+import threading
+import time
+from movies.tools import name_key
+from movies.conf import NOT_FOUND
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS CACHE
+             ([KEY] text PRIMARY KEY, [VALUE] text, [EXPIRES] real, [LAST_USED] real);""",
+    """CREATE INDEX IF NOT EXISTS cache_last_used ON CACHE (LAST_USED);""",
+]
+
+QUERY = {
+    "get": """SELECT KEY, VALUE FROM CACHE WHERE KEY IN ({}) AND EXPIRES>?;""",
+    "touch": """UPDATE CACHE SET LAST_USED=? WHERE KEY=?;""",
+    "put": """INSERT OR REPLACE INTO CACHE (KEY, VALUE, EXPIRES, LAST_USED) VALUES (?, ?, ?, ?);""",
+    "evict": """DELETE FROM CACHE WHERE KEY IN (SELECT KEY FROM CACHE ORDER BY LAST_USED DESC LIMIT -1 OFFSET ?);""",
+    "expire": """DELETE FROM CACHE WHERE EXPIRES<=?;""",
+}
+
+
+class DiskCache:
+    """SQLite backed JSON store with per entry TTL and least recently used eviction."""
+
+    def __init__(self, filepath, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.con = sq3.connect(filepath, check_same_thread=False)
+        with self.con:
+            for statement in SCHEMA:
+                self.con.execute(statement)
+
+    def get_many(self, keys):
+        keys, now = list(keys), time.time()
+        if not keys:
+            return {}
+        with self.lock, self.con:
+            rows = self.con.execute(
+                QUERY["get"].format(", ".join("?" * len(keys))), (*keys, now)
+            ).fetchall()
+            self.con.executemany(QUERY["touch"], [(now, key) for key, _ in rows])
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items, ttl=None):
+        now = time.time()
+        rows = [
+            (key, json.dumps(value), now + (ttl or self.ttl), now)
+            for key, value in items
+        ]
+        with self.lock, self.con:
+            self.con.executemany(QUERY["put"], rows)
+
+    def put(self, key, value, ttl=None):
+        self.put_many([(key, value)], ttl=ttl)
+
+    def evict(self):
+        with self.lock, self.con:
+            self.con.execute(QUERY["expire"], (time.time(),))
+            self.con.execute(QUERY["evict"], (self.size,))
+
+    def close(self):
+        self.con.close()
+
+
+class ResponseCache(DiskCache):
+    """OMDb responses keyed by normalized title or IMDb id.
+    Not found responses are kept as negative entries with their own TTL, other
+    errors, like a reached request limit, aren't kept.
+    """
+
+    def __init__(self, filepath, ttl, negative_ttl, size):
+        super().__init__(filepath, ttl, size)
+        self.negative_ttl = negative_ttl
+
+    def store(self, responses):
+        found = [(k, v) for k, v in responses.items() if v.get("Response") != "False"]
+        missing = [(k, v) for k, v in responses.items() if v.get("Error") == NOT_FOUND]
+        self.put_many(found)
+        self.put_many(missing, ttl=self.negative_ttl)
+        self.evict()
+
+
+class QueryCache(DiskCache):
+    """Query results keyed by SQL, its parameters and data version of the database.
+    A write to the database changes the version, so earlier results are never
+    read again and get evicted as least recently used.
+    """
+
+    def __init__(self, filepath, ttl, size, max_rows):
+        super().__init__(filepath, ttl, size)
+        self.max_rows = max_rows
+
+    @staticmethod
+    def key(version, sql, params=None):
+        digest = hashlib.sha1(json.dumps([sql, params]).encode()).hexdigest()
+        return f"{version}:{digest}"
+
+    def rows(self, key):
+        rows = self.get(key)
+        return None if rows is None else [tuple(row) for row in rows]
+
+    def store(self, key, rows):
+        """Yield rows, keep them when iterated to the end, unless there are more
+        than max_rows of them."""
+        kept = []
+        for row in rows:
+            if kept is not None:
+                kept.append(row)
+                if len(kept) > self.max_rows:
+                    kept = None
+            yield row
+        if kept is not None:
+            self.put(key, kept)
+            self.evict()
+
+
+def cache_key(title):
+    return name_key(title)
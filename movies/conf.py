@@ -1,6 +1,45 @@
 DB_FP = "files/copy_movies.sqlite"
 SITE = "http://www.omdbapi.com"
 CREDENTIALS = "files/credentials.json"
-INITIAL_DB_CHECKSUM = "d0d3c849b4de5dc1a76529b563f3f68cff0ef880"
+WORKERS = 8
+POOL_SIZE = 8
+TIMEOUT = 10
+CACHE_FP = "files/responses.sqlite"
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_NEGATIVE_TTL = 24 * 60 * 60
+NOT_FOUND = "Movie not found!"
+CACHE_SIZE = 100000
+CREDENTIALS_TTL = 24 * 60 * 60
+QUERY_CACHE_FP = "files/queries.sqlite"
+QUERY_CACHE_TTL = 30 * 24 * 60 * 60
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_ROWS = 20000
+FETCH_BATCH = 500
+REFRESH_AGE = 30 * 24 * 60 * 60
+MISSING_AGE = 24 * 60 * 60
+IMPORT_BATCH = 10000
+SEARCH_LIMIT = 100
+TITLE_CANDIDATES = 20
+TITLE_SCAN = 1000
+TITLE_MATCH = 0.4
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+BUSY_TIMEOUT = 30
+PRAGMA_PROFILES = {
+    "write": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16384,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "read": {
+        "cache_size": -16384,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "query_only": "ON",
+    },
+}
+BULK_PRAGMAS = {"synchronous": "OFF", "cache_size": -65536, "temp_store": "MEMORY"}
 
 DATA_MAP = {'Title': 'TITLE', 'Year': 'YEAR', 'Runtime': 'RUNTIME', 'Genre': 'GENRE', 'Director': 'DIRECTOR', 'Actors': 'CAST', 'Writer': 'WRITER', 'Language': 'LANGUAGE', 'Country': 'COUNTRY', 'Awards': 'AWARDS', 'imdbRating': 'IMDb_Rating', 'imdbVotes': 'IMDb_votes', 'BoxOffice': 'BOX_OFFICE'}
@@ -1,23 +1,118 @@
 import re
+import json
+import os.path
+import pathlib
 import sqlite3 as sq3
-from collections import namedtuple
+from contextlib import contextmanager
 from movies.db.sqlite_extensions import register_functions
-from movies.conf import DB_FP, DATA_MAP
+from movies.db.migrations import (
+    upgrade,
+    schema_version,
+    drop_indexes,
+    restore_indexes,
+    drop_triggers,
+    restore_triggers,
+    MIGRATIONS,
+)
+from movies.db.index import reindex
+from movies.db.query import QUERY, key_trigrams, trigram_match, title_candidates
+from movies.tools import batches, name_key, similarity
+from movies.conf import (
+    DB_FP,
+    DATA_MAP,
+    FETCH_BATCH,
+    IMPORT_BATCH,
+    BULK_PRAGMAS,
+    BUSY_TIMEOUT,
+    PRAGMA_PROFILES,
+    TITLE_CANDIDATES,
+    TITLE_SCAN,
+    TITLE_MATCH,
+)
 
 COLS_RE = re.compile("|".join(DATA_MAP.values()))
 
 # sq3.enable_callback_tracebacks(True)
 
 class DatabaseManager:
-    def __init__(self, tests=False):
-        self.db_fp = "tests/tmp.db" if tests else DB_FP
-        self.con = self._connect()
+    """Writer connections run in WAL mode, so any number of readonly connections
+    can query the file while one of them writes. Both wait BUSY_TIMEOUT seconds
+    for a lock instead of failing.
+    """
 
-    def _connect(self):
-        con = sq3.connect(self.db_fp)
+    def __init__(self, tests=False, readonly=False, db_fp=None):
+        self.db_fp = db_fp or ("tests/tmp.db" if tests else DB_FP)
+        self.readonly = readonly
+        self.con = self._connect(readonly)
+
+    def _connect(self, readonly=False, shared=False):
+        """Shared connections can be used by any thread, one at a time."""
+        if not os.path.isfile(self.db_fp):
+            raise ValueError(f"error: {self.db_fp} not found.")
+        try:
+            if readonly:
+                con = self._connect_readonly(shared)
+            else:
+                con = sq3.connect(
+                    self.db_fp, timeout=BUSY_TIMEOUT, check_same_thread=not shared
+                )
+                apply_pragmas(con, PRAGMA_PROFILES["write"])
+                register_functions(con)
+                upgrade(con)
+        except sq3.Error as err:
+            raise ValueError(err)
+        return con
+
+    def _connect_readonly(self, shared=False):
+        uri = f"{pathlib.Path(self.db_fp).resolve().as_uri()}?mode=ro"
+        con = sq3.connect(
+            uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=not shared
+        )
+        if schema_version(con) < len(MIGRATIONS):
+            # Migrations need a writer, it's needed once per database file.
+            writer = sq3.connect(self.db_fp, timeout=BUSY_TIMEOUT)
+            apply_pragmas(writer, PRAGMA_PROFILES["write"])
+            register_functions(writer)
+            upgrade(writer)
+            writer.close()
+        apply_pragmas(con, PRAGMA_PROFILES["read"])
         register_functions(con)
         return con
 
+    def close(self):
+        self.con.close()
+
+    @contextmanager
+    def writer(self):
+        """Connection to write with, its transaction is committed after the
+        block and rolled back if the block fails."""
+        try:
+            yield self.con
+        except Exception:
+            self.con.rollback()
+            raise
+        self.con.commit()
+
+    def meta(self, key):
+        """Value stored in META table, None if not set."""
+        try:
+            row = self.con.execute(QUERY["meta"], (key,)).fetchone()
+            return row[0] if row else None
+        except sq3.Error as err:
+            raise ValueError(err)
+
+    def data_version(self):
+        """Token of current database content, it changes with every write."""
+        return self.meta("data_version")
+
+    def set_meta(self, key, value):
+        try:
+            with self.writer() as con:
+                con.execute(QUERY["set_meta"], (key, value))
+                con.commit()
+        except sq3.Error as err:
+            raise ValueError(err)
+
     def get_titles(self):
         """List titles."""
         command = "SELECT title FROM movies;"
@@ -34,25 +129,73 @@ class DatabaseManager:
 
     def insert_one(self, query, data, check=False):
         """Insert or update op."""
-        try:        
-            if check:
-                self.has_title(data[0], has=True)
-            self.con.execute(query, data)
-            self.con.commit()
+        try:
+            with self.writer() as con:
+                if check:
+                    self.has_title(data[0], has=True)
+                con.execute(query, data)
+                reindex(con)
+                con.execute(QUERY["bump_version"])
+                con.commit()
         except sq3.Error as err:
             raise ValueError(err)
 
     def insert_many(self, query, data, check=False):
         """Inserts or update ops."""
         try:
-            if check:
-                for movie in data:
-                    self.has_title(movie[0], has=True)
-            self.con.executemany(query, data)
-            self.con.commit()
+            with self.writer() as con:
+                if check:
+                    data = list(data)
+                    duplicates = self.duplicates(movie[0] for movie in data)
+                    if duplicates:
+                        raise ValueError(f"Error: Movies in DB: {', '.join(duplicates)}.")
+                con.executemany(query, data)
+                reindex(con)
+                con.execute(QUERY["bump_version"])
+                con.commit()
         except sq3.Error as err:
             raise ValueError(err)
 
+    def bulk_insert(self, query, data, batch=IMPORT_BATCH):
+        """Insert rows from an iterable, one transaction per batch. Return row count."""
+        count = 0
+        with self.writer() as con, self.bulk_load():
+            for rows in batches(data, batch):
+                try:
+                    with con:
+                        con.executemany(query, rows)
+                        reindex(con)
+                        con.execute(QUERY["bump_version"])
+                except sq3.Error as err:
+                    raise ValueError(err)
+                count += len(rows)
+        return count
+
+    @contextmanager
+    def bulk_load(self):
+        """Relax durability and drop MOVIES indexes and full text triggers while
+        loading, restore them after and rebuild the full text indexes once.
+        Indexes and triggers of a crashed load are restored by the next writer."""
+        with self.writer() as con:
+            try:
+                pragmas = {
+                    name: con.execute(f"PRAGMA {name};").fetchone()[0]
+                    for name in BULK_PRAGMAS
+                }
+                indexes = con.execute(QUERY["movies_indexes"]).fetchall()
+                triggers = con.execute(QUERY["fts_triggers"]).fetchall()
+                apply_pragmas(con, BULK_PRAGMAS)
+                drop_indexes(con, indexes)
+                drop_triggers(con, triggers)
+            except sq3.Error as err:
+                raise ValueError(err)
+            try:
+                yield
+            finally:
+                restore_indexes(con)
+                restore_triggers(con)
+                apply_pragmas(con, pragmas)
+
     def select_one(self, query, data=None, check=False):
         try:    
             cursor = self.con.cursor()
@@ -63,6 +206,31 @@ class DatabaseManager:
         finally: 
             cursor.close()
 
+    def iter_select(self, query, data=None, check=False, batch=FETCH_BATCH):
+        """Run query now, yield its rows fetched in batches of given size."""
+        cursor = self.con.cursor()
+        try:
+            self.select_logic(cursor, query, data=data, check=check)
+        except sq3.Error as err:
+            cursor.close()
+            raise ValueError(err)
+        except ValueError:
+            cursor.close()
+            raise
+        return self._fetch_batches(cursor, batch)
+
+    def _fetch_batches(self, cursor, batch):
+        try:
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    return
+                yield from rows
+        except sq3.Error as err:
+            raise ValueError(err)
+        finally:
+            cursor.close()
+
     def select_logic(self, cursor, query, data=None, check=False):
         if data:
             if check:
@@ -80,12 +248,62 @@ class DatabaseManager:
         return data
 
     def has_title(self, title, has):
-        """Check whether movie title is in db."""
-        query = "select * from movies where title=?"
+        """Check whether movie title, in any case, is in db."""
         try:
             cur = self.con.cursor()
-            movie = cur.execute(query, tuple([title])).fetchone()
+            movie = cur.execute(QUERY["has_title"], (title,)).fetchone()[0]
             if has == bool(movie):
                 raise ValueError(f'Error: Movie {"is" if has else "not"} in DB.')
         finally:
             cur.close()
+
+    def find_title(self, title, fuzzy=True):
+        """(ID, TITLE) of the movie stored under title in any case, None if
+        there's none. With fuzzy, a misspelled title gives the most similar
+        stored one. Candidates are titles holding the rarest trigrams of title,
+        about TITLE_SCAN of them however many movies there are, ranked by
+        the number of trigrams they share with it."""
+        row = self.con.execute(QUERY["find_title"], (title,)).fetchone()
+        key = name_key(title)
+        if row is not None or not fuzzy or len(key) < 3:
+            return row and tuple(row)
+        grams = key_trigrams(key)
+        rare, scanned = [], 0
+        for gram, count in self.con.execute(QUERY["trigram_docs"], (json.dumps(grams),)):
+            if scanned >= TITLE_SCAN:
+                break
+            rare.append(gram)
+            scanned += count
+        if not rare:
+            return None
+        candidates = self.con.execute(
+            title_candidates(len(grams)), (trigram_match(rare), TITLE_CANDIDATES, *grams)
+        ).fetchall()
+        score, _, movie_id, stored = max(
+            ((similarity(key, cand_key), -cand_id, cand_id, cand_title)
+             for cand_id, cand_title, cand_key in candidates),
+            default=(0, 0, None, None),
+        )
+        return (movie_id, stored) if score >= TITLE_MATCH else None
+
+    def resolve_title(self, title, fuzzy=True):
+        """As find_title, raise if no movie matches."""
+        movie = self.find_title(title, fuzzy)
+        if movie is None:
+            raise ValueError(f"Error: Movie not in DB: {title}.")
+        return movie
+
+    def duplicates(self, titles):
+        """Titles already in db, or repeated among titles, found in one query."""
+        rows = self.select_one(QUERY["duplicates"], (json.dumps(list(titles)),))
+        return [row[0] for row in rows]
+
+    def stored(self, titles):
+        """Titles already in db, found in one query."""
+        rows = self.select_one(QUERY["stored"], (json.dumps(list(titles)),))
+        return [row[0] for row in rows]
+
+
+def apply_pragmas(con, pragmas):
+    for name, value in pragmas.items():
+        con.execute(f"PRAGMA {name}={value};")
@@ -0,0 +1,39 @@
+import movies.db.query as query
+from movies.tools import split_names, name_key
+
+
+def reindex(con):
+    """Rebuild lookup tables of movies queued by MOVIES triggers."""
+    rows = con.execute(query.queued()).fetchall()
+    if not rows:
+        return
+    ids = [(row[0],) for row in rows]
+    _people(con, rows, ids)
+    for i, col in enumerate(query.FACETS, start=len(query.ROLES) + 1):
+        _facet(con, col, [(row[0], row[i]) for row in rows], ids)
+    con.execute(query.QUERY["clear_queue"])
+
+
+def _people(con, rows, ids):
+    people, links = {}, []
+    for movie_id, *values in rows:
+        for role, value in zip(query.ROLES, values):
+            for name in split_names(value):
+                key = name_key(name)
+                people.setdefault(key, name)
+                links.append((movie_id, role, key))
+    con.executemany(query.QUERY["unlink_people"], ids)
+    con.executemany(query.QUERY["add_person"], [(n, k) for k, n in people.items()])
+    con.executemany(query.QUERY["link_person"], links)
+
+
+def _facet(con, col, rows, ids):
+    names, links = {}, []
+    for movie_id, value in rows:
+        for name in split_names(value):
+            key = name_key(name)
+            names.setdefault(key, name)
+            links.append((movie_id, key))
+    con.executemany(query.facet("unlink_facet", col), ids)
+    con.executemany(query.facet("add_facet", col), [(n, k) for k, n in names.items()])
+    con.executemany(query.facet("link_facet", col), links)
@@ -0,0 +1,310 @@
+"""Ordered schema changes. Applied migrations are counted in META, a new one is
+appended to MIGRATIONS and runs once on every database file that lacks it.
+"""
+import sys
+import json
+import sqlite3 as sq3
+from itertools import groupby
+from operator import itemgetter
+import movies.db.query as query
+from movies.db.index import reindex
+
+MOVIES = """CREATE TABLE IF NOT EXISTS MOVIES
+             ([ID] INTEGER PRIMARY KEY,[TITLE] text, [YEAR] integer, [RUNTIME] text, [GENRE] text, [DIRECTOR] text, [CAST] text, 
+             [WRITER] text, [LANGUAGE] text, [COUNTRY] text, [AWARDS] text, [IMDb_Rating] float, [IMDb_votes] integer, [BOX_OFFICE] integer
+             );"""
+
+META = """CREATE TABLE IF NOT EXISTS META ([KEY] text PRIMARY KEY, [VALUE]);"""
+
+AWARD_INDEXES = {
+    "movies_awards_won": "AWARDS_WON",
+    "movies_nominations": "NOMINATIONS",
+    "movies_oscars_won": "OSCARS_WON",
+    "movies_oscars_nom": "OSCARS_NOM",
+}
+
+FETCH_COLUMNS = {"LAST_FETCHED": "real", "CONTENT_HASH": "text"}
+
+FETCH_INDEXES = {
+    "movies_last_fetched": "LAST_FETCHED",
+    "movies_title": "TITLE",
+}
+
+# Indexes on sort keys, replaced by their descending sort indexes
+RETIRED_INDEXES = ["movies_title", "movies_awards_won", "movies_nominations", "movies_oscars_won"]
+
+PEOPLE = [
+    """CREATE TABLE IF NOT EXISTS PEOPLE
+             ([ID] INTEGER PRIMARY KEY, [NAME] text, [NAME_KEY] text UNIQUE);""",
+    """CREATE TABLE IF NOT EXISTS MOVIE_PEOPLE
+             ([MOVIE_ID] integer, [PERSON_ID] integer, [ROLE] text,
+             PRIMARY KEY (PERSON_ID, ROLE, MOVIE_ID)) WITHOUT ROWID;""",
+    """CREATE INDEX IF NOT EXISTS movie_people_movie ON MOVIE_PEOPLE (MOVIE_ID);""",
+    """CREATE TABLE IF NOT EXISTS INDEX_QUEUE ([MOVIE_ID] INTEGER PRIMARY KEY);""",
+    """CREATE TRIGGER IF NOT EXISTS movies_queue_insert AFTER INSERT ON MOVIES
+             BEGIN INSERT OR IGNORE INTO INDEX_QUEUE VALUES (NEW.ID); END;""",
+    """CREATE TRIGGER IF NOT EXISTS movies_queue_update AFTER UPDATE OF DIRECTOR, "CAST", WRITER ON MOVIES
+             BEGIN INSERT OR IGNORE INTO INDEX_QUEUE VALUES (NEW.ID); END;""",
+    """CREATE TRIGGER IF NOT EXISTS movies_unlink_delete AFTER DELETE ON MOVIES
+             BEGIN DELETE FROM MOVIE_PEOPLE WHERE MOVIE_ID=OLD.ID; END;""",
+]
+
+FACET = [
+    """CREATE TABLE IF NOT EXISTS {0}
+             ([ID] INTEGER PRIMARY KEY, [NAME] text, [NAME_KEY] text UNIQUE);""",
+    """CREATE TABLE IF NOT EXISTS MOVIE_{0}
+             ([MOVIE_ID] integer, [FACET_ID] integer,
+             PRIMARY KEY (FACET_ID, MOVIE_ID)) WITHOUT ROWID;""",
+    """CREATE INDEX IF NOT EXISTS movie_{0}_movie ON MOVIE_{0} (MOVIE_ID);""",
+]
+
+FACET_TRIGGERS = [
+    """DROP TRIGGER IF EXISTS movies_queue_update;""",
+    """DROP TRIGGER IF EXISTS movies_unlink_delete;""",
+    """CREATE TRIGGER movies_queue_update
+             AFTER UPDATE OF DIRECTOR, "CAST", WRITER, LANGUAGE, COUNTRY, GENRE ON MOVIES
+             BEGIN INSERT OR IGNORE INTO INDEX_QUEUE VALUES (NEW.ID); END;""",
+    """CREATE TRIGGER movies_unlink_delete AFTER DELETE ON MOVIES
+             BEGIN
+             DELETE FROM MOVIE_PEOPLE WHERE MOVIE_ID=OLD.ID;
+             DELETE FROM MOVIE_LANGUAGES WHERE MOVIE_ID=OLD.ID;
+             DELETE FROM MOVIE_COUNTRIES WHERE MOVIE_ID=OLD.ID;
+             DELETE FROM MOVIE_GENRES WHERE MOVIE_ID=OLD.ID;
+             END;""",
+]
+
+TITLE_DUPLICATES = """SELECT TITLE_KEY, ID, {0} FROM MOVIES WHERE TITLE_KEY IN
+             (SELECT TITLE_KEY FROM MOVIES GROUP BY TITLE_KEY HAVING COUNT(*)>1) ORDER BY TITLE_KEY, {1} DESC, ID;"""
+
+MERGE_TITLE = """UPDATE MOVIES SET {} WHERE ID=?;"""
+
+FULL_TEXT_COLUMNS = 'TITLE, "CAST", DIRECTOR, WRITER, GENRE, AWARDS'
+
+FULL_TEXT = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS MOVIES_FTS USING fts5
+             ({0}, content='MOVIES', content_rowid='ID', tokenize='unicode61 remove_diacritics 2');""",
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON MOVIES
+             BEGIN INSERT INTO MOVIES_FTS (rowid, {0}) VALUES (NEW.ID, {1}); END;""",
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON MOVIES
+             BEGIN INSERT INTO MOVIES_FTS (MOVIES_FTS, rowid, {0}) VALUES ('delete', OLD.ID, {2}); END;""",
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF {0} ON MOVIES
+             BEGIN
+             INSERT INTO MOVIES_FTS (MOVIES_FTS, rowid, {0}) VALUES ('delete', OLD.ID, {2});
+             INSERT INTO MOVIES_FTS (rowid, {0}) VALUES (NEW.ID, {1});
+             END;""",
+    """INSERT INTO MOVIES_FTS (MOVIES_FTS) VALUES ('rebuild');""",
+]
+
+TITLE_TRIGRAMS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS TITLES_TRIGRAM USING fts5
+             (TITLE_KEY, content='MOVIES', content_rowid='ID', tokenize='trigram');""",
+    """CREATE TRIGGER IF NOT EXISTS titles_trigram_insert AFTER INSERT ON MOVIES
+             BEGIN INSERT INTO TITLES_TRIGRAM (rowid, TITLE_KEY) VALUES (NEW.ID, NEW.TITLE_KEY); END;""",
+    """CREATE TRIGGER IF NOT EXISTS titles_trigram_delete AFTER DELETE ON MOVIES
+             BEGIN INSERT INTO TITLES_TRIGRAM (TITLES_TRIGRAM, rowid, TITLE_KEY) VALUES ('delete', OLD.ID, OLD.TITLE_KEY); END;""",
+    """CREATE TRIGGER IF NOT EXISTS titles_trigram_update AFTER UPDATE OF TITLE_KEY ON MOVIES
+             BEGIN
+             INSERT INTO TITLES_TRIGRAM (TITLES_TRIGRAM, rowid, TITLE_KEY) VALUES ('delete', OLD.ID, OLD.TITLE_KEY);
+             INSERT INTO TITLES_TRIGRAM (rowid, TITLE_KEY) VALUES (NEW.ID, NEW.TITLE_KEY);
+             END;""",
+    """INSERT INTO TITLES_TRIGRAM (TITLES_TRIGRAM) VALUES ('rebuild');""",
+]
+
+FTS_TABLES = ["MOVIES_FTS", "TITLES_TRIGRAM"]
+
+TRIGRAM_VOCAB = """CREATE VIRTUAL TABLE IF NOT EXISTS TITLES_TRIGRAM_VOCAB USING fts5vocab(TITLES_TRIGRAM, 'row');"""
+
+
+def movies_table(con):
+    con.execute(MOVIES)
+
+
+def award_columns(con):
+    for col in query.DERIVED:
+        _add_column(con, col, "integer")
+    con.execute(query.derive())
+    _add_indexes(con, AWARD_INDEXES)
+
+
+def people_index(con):
+    _execute(con, PEOPLE)
+    con.execute(query.QUERY["queue_all"])
+
+
+def facet_index(con):
+    for table in query.FACETS.values():
+        _execute(con, FACET, table)
+    _execute(con, FACET_TRIGGERS)
+    con.execute(query.QUERY["queue_all"])
+
+
+def fetch_columns(con):
+    for col, type_ in FETCH_COLUMNS.items():
+        _add_column(con, col, type_)
+    _add_indexes(con, FETCH_INDEXES)
+
+
+def population_state(con):
+    """Files populated before META existed hold downloaded data already."""
+    populated = con.execute(query.QUERY["has_data"]).fetchone()[0]
+    con.execute(query.QUERY["set_meta"], ("populated", populated))
+
+
+def title_key(con):
+    """Unique case normalized title. Movies with titles differing only in case
+    are merged into the one holding most data, the first one added of equals.
+    Values it's missing are taken from the others."""
+    _add_column(con, "TITLE_KEY", "text")
+    con.execute("UPDATE MOVIES SET TITLE_KEY=name_key(TITLE);")
+    cols = query.DATA_MAP_VALUES[1:]
+    populated = " + ".join(f'(ifnull("{col}", "N/A")!="N/A")' for col in cols)
+    rows = con.execute(
+        TITLE_DUPLICATES.format(", ".join(f'"{col}"' for col in cols), populated)
+    ).fetchall()
+    merged = 0
+    for _, group in groupby(rows, itemgetter(0)):
+        (_, movie_id, *values), *others = group
+        for row in others:
+            values = [old if old not in (None, "N/A") else new for old, new in zip(values, row[2:])]
+            con.execute("DELETE FROM MOVIES WHERE ID=?;", (row[1],))
+        con.execute(MERGE_TITLE.format(", ".join(f'"{col}"=?' for col in cols)), (*values, movie_id))
+        merged += len(others)
+    if merged:
+        con.execute(query.derive())
+        print(f"Merged {merged} movies into ones with the same title in another case.", file=sys.stderr)
+    con.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS movies_title_key ON MOVIES (TITLE_KEY);"
+    )
+
+
+def full_text(con):
+    """Search index over text columns, external content kept in sync by triggers."""
+    cols = FULL_TEXT_COLUMNS.split(", ")
+    new = ", ".join(f"NEW.{col}" for col in cols)
+    old = ", ".join(f"OLD.{col}" for col in cols)
+    _execute(con, FULL_TEXT, FULL_TEXT_COLUMNS, new, old)
+
+
+def title_trigrams(con):
+    """Trigram index of title keys, to resolve misspelled titles."""
+    _execute(con, TITLE_TRIGRAMS)
+
+
+def trigram_vocab(con):
+    """Number of titles holding every trigram, rare ones narrow fuzzy lookups."""
+    con.execute(TRIGRAM_VOCAB)
+
+
+def sort_indexes(con):
+    """Descending expression indexes on sort keys, needs deterministic functions.
+    They serve lookups of the plain indexes on the same keys, which are dropped."""
+    for name in RETIRED_INDEXES:
+        con.execute(f"DROP INDEX IF EXISTS {name};")
+    for name, key in query.sort_indexes().items():
+        con.execute(f"CREATE INDEX IF NOT EXISTS {name} ON MOVIES ({key} DESC);")
+
+
+def data_version(con):
+    """Random token replaced by every write, cached query results are keyed by it."""
+    con.execute(query.QUERY["bump_version"])
+
+
+MIGRATIONS = [
+    movies_table,
+    award_columns,
+    people_index,
+    facet_index,
+    fetch_columns,
+    population_state,
+    data_version,
+    title_key,
+    full_text,
+    title_trigrams,
+    sort_indexes,
+    trigram_vocab,
+]
+
+
+def schema_version(con):
+    try:
+        row = con.execute(query.QUERY["meta"], ("schema_version",)).fetchone()
+    except sq3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def upgrade(con):
+    """Apply migrations missing from the database file, in order."""
+    version = schema_version(con)
+    if version:
+        restore_indexes(con)
+        restore_triggers(con)
+    if version >= len(MIGRATIONS):
+        return
+    with con:
+        con.execute(META)
+        for migration in MIGRATIONS[version:]:
+            migration(con)
+        con.execute(query.QUERY["set_meta"], ("schema_version", len(MIGRATIONS)))
+        con.execute(query.QUERY["bump_version"])
+        reindex(con)
+
+
+def drop_indexes(con, indexes):
+    """Drop MOVIES indexes for a bulk load, their SQL is kept in META until
+    restore_indexes() recreates them, even if the load is cut short."""
+    with con:
+        con.execute(query.QUERY["set_meta"], ("dropped_indexes", json.dumps(indexes)))
+        for name, _ in indexes:
+            con.execute(f"DROP INDEX IF EXISTS {name};")
+
+
+def restore_indexes(con):
+    """Recreate indexes dropped by drop_indexes(), if any are left."""
+    row = con.execute(query.QUERY["meta"], ("dropped_indexes",)).fetchone()
+    if row is None:
+        return
+    with con:
+        for _, sql in json.loads(row[0]):
+            con.execute(sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        con.execute(query.QUERY["del_meta"], ("dropped_indexes",))
+
+
+def drop_triggers(con, triggers):
+    """Drop full text triggers for a bulk load, their SQL is kept in META until
+    restore_triggers() recreates them and rebuilds the full text indexes."""
+    with con:
+        con.execute(query.QUERY["set_meta"], ("dropped_triggers", json.dumps(triggers)))
+        for name, _ in triggers:
+            con.execute(f"DROP TRIGGER IF EXISTS {name};")
+
+
+def restore_triggers(con):
+    """Recreate triggers dropped by drop_triggers(), if any are left, and
+    rebuild the full text indexes they would have kept up to date."""
+    row = con.execute(query.QUERY["meta"], ("dropped_triggers",)).fetchone()
+    if row is None:
+        return
+    with con:
+        for name, sql in json.loads(row[0]):
+            con.execute(f"DROP TRIGGER IF EXISTS {name};")
+            con.execute(sql)
+        for table in FTS_TABLES:
+            con.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild');")
+        con.execute(query.QUERY["del_meta"], ("dropped_triggers",))
+
+
+def _execute(con, statements, *args):
+    for statement in statements:
+        con.execute(statement.format(*args))
+
+
+def _add_column(con, col, type_):
+    columns = {row[1] for row in con.execute("PRAGMA table_info(MOVIES);")}
+    if col not in columns:
+        con.execute(f'ALTER TABLE MOVIES ADD COLUMN "{col}" {type_};')
+
+
+def _add_indexes(con, indexes):
+    for name, col in indexes.items():
+        con.execute(f'CREATE INDEX IF NOT EXISTS {name} ON MOVIES ("{col}");')
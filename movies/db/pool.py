@@ -0,0 +1,46 @@
+import threading
+from contextlib import contextmanager
+from movies.db.dbm import DatabaseManager
+from movies.conf import DB_FP
+
+
+class PooledDatabaseManager(DatabaseManager):
+    """DatabaseManager shared by threads of one process. Every thread queries
+    through its own readonly connection, opened on first use and kept until
+    close(). Writes go through a single writer connection, one thread at a time.
+    """
+
+    def __init__(self, tests=False, db_fp=None):
+        self.db_fp = db_fp or ("tests/tmp.db" if tests else DB_FP)
+        self.readonly = False
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._readers = []
+        self._writer = self._connect(shared=True)
+
+    @property
+    def con(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._connect(readonly=True, shared=True)
+            with self._lock:
+                self._readers.append(con)
+        return con
+
+    @contextmanager
+    def writer(self):
+        with self._lock:
+            try:
+                yield self._writer
+            except Exception:
+                self._writer.rollback()
+                raise
+            self._writer.commit()
+
+    def close(self):
+        with self._lock:
+            for con in self._readers:
+                con.close()
+            self._readers.clear()
+            self._writer.close()
+        self._local = threading.local()
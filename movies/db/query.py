@@ -1,20 +1,51 @@
+import re
 from operator import iadd
 from movies.conf import DATA_MAP
+from movies.tools import name_key
+
+PERSON = """ID IN (SELECT MOVIE_ID FROM MOVIE_PEOPLE JOIN PEOPLE ON PEOPLE.ID=PERSON_ID WHERE NAME_KEY=name_key(?) AND ROLE='{}')"""
+
+FACET = """ID IN (SELECT MOVIE_ID FROM MOVIE_{0} JOIN {0} ON {0}.ID=FACET_ID WHERE NAME_KEY=name_key(?))"""
 
 FILTER = {
-    "director": ("DIRECTOR", "DIRECTOR=has_person(DIRECTOR, ?)"),
-    "actor": ("CAST", '"CAST"=has_person("CAST", ?)'),
-    "eighty": ("AWARDS", "AWARDS=won_80_nom(AWARDS)"),
-    "oscar_nom": ("AWARDS", "AWARDS=has_osc_nom(AWARDS)"),
+    "director": ("DIRECTOR", PERSON.format("director")),
+    "actor": ("CAST", PERSON.format("actor")),
+    "writer": ("WRITER", PERSON.format("writer")),
+    "people": (
+        "CAST",
+        """ID IN (SELECT MOVIE_ID FROM MOVIE_PEOPLE JOIN PEOPLE ON PEOPLE.ID=PERSON_ID WHERE NAME_KEY IN ({marks}) GROUP BY MOVIE_ID HAVING COUNT(DISTINCT PERSON_ID)={n})""",
+    ),
+    "eighty": ("AWARDS", "NOMINATIONS>0 AND AWARDS_WON>?*NOMINATIONS"),
+    "oscar_nom": ("AWARDS", "OSCARS_NOM>0"),
     "boxoffice": ("BOX_OFFICE", "BOX_OFFICE>100000000"),
-    "language": ("LANGUAGE", "LANGUAGE=has_language(LANGUAGE, ?)"),
+    "language": ("LANGUAGE", FACET.format("LANGUAGES")),
+    "country": ("COUNTRY", FACET.format("COUNTRIES")),
+    "genre": ("GENRE", FACET.format("GENRES")),
+}
+
+FILTER_ARGS = {
+    "director": (str, None),
+    "actor": (str, None),
+    "writer": (str, None),
+    "people": (name_key, None),
+    "language": (str, None),
+    "country": (str, None),
+    "genre": (str, None),
+    "eighty": (float, 0.8),
 }
 
+MULTI_FILTERS = {"people"}
+
+ROLES = {"director": "DIRECTOR", "actor": "CAST", "writer": "WRITER"}
+
+FACETS = {"LANGUAGE": "LANGUAGES", "COUNTRY": "COUNTRIES", "GENRE": "GENRES"}
+
+# Category: (formatting, compared value)
 COMPARE = {
-    "imdb": "str(MAX(IMDb_Rating))",
-    "boxoffice": "int_to_account(MAX(BOX_OFFICE))",
-    "awards": "str(MAX(awards_won(AWARDS)))",
-    "runtime": "tform(MAX(clnstr(RUNTIME)))",
+    "imdb": ("str", "IMDb_Rating"),
+    "boxoffice": ("int_to_account", "BOX_OFFICE"),
+    "awards": ("str", "AWARDS_WON"),
+    "runtime": ("tform", "clnstr(RUNTIME)"),
 }
 
 SORT = {
@@ -27,7 +58,7 @@ SORT = {
     "writer": ('"WRITER"', '"WRITER"'),
     "language": ('"LANGUAGE"', '"LANGUAGE"'),
     "country": ("COUNTRY", "COUNTRY"),
-    "awards": ('_str(awards_won("AWARDS"))', "awards_won(AWARDS)"),
+    "awards": ('_str("AWARDS_WON")', '"AWARDS_WON"'),
     "rating": ('_str("IMDb_Rating")', "IMDb_Rating"),
     "votes": ('int_to_comas("IMDb_votes")', "IMDb_votes"),
     "boxoffice": ('int_to_account("BOX_OFFICE")', "BOX_OFFICE"),
@@ -44,28 +75,93 @@ SELECT_CONV = {
 
 INSERT_CONV = {
     "year": "clnstr",
-    "imdb_rating": "float",
+    "imdb_rating": "_float",
     "imdb_votes": "clnstr",
     "box_office": "clnstr",
 }
 
-HIGHSCORES = [
-    ("tform(RUNTIME)", "clnstr(RUNTIME)"),
-    ("int_to_account(BOX_OFFICE)", "BOX_OFFICE"),
-    ("_str(awards_won(AWARDS))", "awards_won(AWARDS)"),
-    ("_str(nominations(AWARDS))", "nominations(AWARDS)"),
-    ("_str(osc_won(AWARDS))", "osc_won(AWARDS)"),
-    ("_str(IMDb_Rating)", "IMDB_RATING"),
+DERIVED = {
+    "AWARDS_WON": ("awards_won", "AWARDS"),
+    "NOMINATIONS": ("nominations", "AWARDS"),
+    "OSCARS_WON": ("osc_won", "AWARDS"),
+    "OSCARS_NOM": ("osc_nom", "AWARDS"),
+}
+
+PERSON_GROUP = """SELECT MOVIE_ID, NAME AS GRP FROM MOVIE_PEOPLE JOIN PEOPLE ON PEOPLE.ID=PERSON_ID WHERE ROLE='{}'"""
+
+FACET_GROUP = """SELECT MOVIE_ID, NAME AS GRP FROM MOVIE_{0} JOIN {0} ON {0}.ID=FACET_ID"""
+
+# Group: (query of MOVIE_ID, GRP pairs, order of groups)
+STATS = {
+    "year": ("SELECT ID AS MOVIE_ID, YEAR AS GRP FROM MOVIES WHERE YEAR IS NOT NULL", "GRP"),
+    "decade": ("SELECT ID AS MOVIE_ID, YEAR/10*10 AS GRP FROM MOVIES WHERE YEAR IS NOT NULL", "GRP"),
+    "director": (PERSON_GROUP.format("director"), "COUNT(*) DESC, GRP"),
+    "actor": (PERSON_GROUP.format("actor"), "COUNT(*) DESC, GRP"),
+    "writer": (PERSON_GROUP.format("writer"), "COUNT(*) DESC, GRP"),
+    "genre": (FACET_GROUP.format("GENRES"), "COUNT(*) DESC, GRP"),
+    "language": (FACET_GROUP.format("LANGUAGES"), "COUNT(*) DESC, GRP"),
+    "country": (FACET_GROUP.format("COUNTRIES"), "COUNT(*) DESC, GRP"),
+}
+
+# Formatting and aggregate of every group in stats()
+STATS_VALUES = [
+    ("_str", "COUNT(*)"),
+    ("_str", "ROUND(AVG(RATING), 2)"),
+    ("int_to_account", "SUM(BOX_OFFICE)"),
+    ("", "MAX(CASE WHEN N=1 AND RATING IS NOT NULL THEN TITLE END)"),
 ]
 
+HIGHSCORES = {
+    "Runtime": ("tform", "clnstr(RUNTIME)"),
+    "Box Office": ("int_to_account", "BOX_OFFICE"),
+    "Awards Won": ("_str", "AWARDS_WON"),
+    "Nominations": ("_str", "NOMINATIONS"),
+    "Oscars": ("_str", "OSCARS_WON"),
+    "IMDB Rating": ("_str", "IMDB_RATING"),
+}
+
 QUERY = {
-    "filter": """SELECT TITLE, {} FROM MOVIES WHERE {};""",
-    "sort": """SELECT TITLE{} FROM MOVIES ORDER BY {};""",
-    "highscores": """SELECT TITLE, {} FROM MOVIES ORDER BY {} DESC LIMIT 1;""",
-    "insert": """INSERT INTO MOVIES ({}) VALUES ({});""",
-    "update": """UPDATE MOVIES SET {} WHERE TITLE=?;""",
+    "filter": """SELECT TITLE, {} FROM MOVIES WHERE {} ORDER BY ID;""",
+    "sort": """SELECT TITLE{} FROM MOVIES ORDER BY {}, ID;""",
+    "search": """SELECT MOVIES.TITLE, {}, {}, {} FROM MOVIES_FTS JOIN MOVIES ON MOVIES.ID=MOVIES_FTS.rowid
+             WHERE MOVIES_FTS MATCH ? ORDER BY bm25(MOVIES_FTS, 10.0, 4.0, 4.0, 2.0, 1.0, 1.0), MOVIES.ID LIMIT ?;""",
+    "snapshot": """SELECT ID, TITLE, {} FROM MOVIES ORDER BY ID;""",
+    "stats": """WITH RANKED AS (SELECT GRP, TITLE, IMDb_Rating AS RATING, BOX_OFFICE, ROW_NUMBER() OVER (PARTITION BY GRP ORDER BY IMDb_Rating IS NULL, IMDb_Rating DESC, ID) AS N
+             FROM ({}) JOIN MOVIES ON ID=MOVIE_ID)
+             SELECT {}, {} FROM RANKED GROUP BY GRP HAVING COUNT(*)>=? ORDER BY {};""",
+    "highscores": """SELECT CATEGORY, TITLE, VALUE FROM ({}) ORDER BY POS, K DESC, ID;""",
+    "highscore": """SELECT {0} AS POS, '{1}' AS CATEGORY, TITLE, {2} AS VALUE, {3} AS K, ID FROM MOVIES
+             WHERE {3}>0 AND {3}>=ifnull((SELECT {3} FROM MOVIES WHERE {3}>0 ORDER BY {3} DESC LIMIT 1 OFFSET ?1-1), 0)""",
+    "upsert": """INSERT INTO MOVIES ({}) VALUES ({}) ON CONFLICT (TITLE_KEY) DO UPDATE SET {};""",
+    "derive": """UPDATE MOVIES SET {} WHERE AWARDS IS NOT NULL;""",
+    "stale": """SELECT TITLE, CONTENT_HASH FROM MOVIES WHERE LAST_FETCHED IS NULL OR LAST_FETCHED<?1 OR (LAST_FETCHED<?2 AND ({}));""",
+    "fetched": """UPDATE MOVIES SET LAST_FETCHED=?, CONTENT_HASH=? WHERE TITLE=?;""",
+    "meta": """SELECT VALUE FROM META WHERE KEY=?;""",
+    "set_meta": """INSERT OR REPLACE INTO META (KEY, VALUE) VALUES (?, ?);""",
+    "del_meta": """DELETE FROM META WHERE KEY=?;""",
+    "bump_version": """INSERT OR REPLACE INTO META (KEY, VALUE) VALUES ('data_version', lower(hex(randomblob(8))));""",
+    "fts_triggers": """SELECT NAME, SQL FROM sqlite_master WHERE TYPE='trigger' AND TBL_NAME='MOVIES' AND (NAME GLOB 'movies_fts_*' OR NAME GLOB 'titles_trigram_*');""",
+    "movies_indexes": """SELECT NAME, SQL FROM sqlite_master WHERE TYPE='index' AND TBL_NAME='MOVIES' AND SQL IS NOT NULL AND SQL NOT LIKE 'CREATE UNIQUE%';""",
+    "duplicates": """SELECT VALUE FROM (SELECT KEY, VALUE, ROW_NUMBER() OVER (PARTITION BY name_key(VALUE) ORDER BY KEY) AS N FROM json_each(?)) AS T
+             WHERE N>1 OR EXISTS (SELECT 1 FROM MOVIES WHERE TITLE_KEY=name_key(T.VALUE)) ORDER BY KEY;""",
+    "stored": """SELECT VALUE FROM json_each(?) WHERE EXISTS (SELECT 1 FROM MOVIES WHERE TITLE_KEY=name_key(VALUE)) ORDER BY KEY;""",
+    "find_title": """SELECT ID, TITLE FROM MOVIES WHERE TITLE_KEY=name_key(?);""",
+    "trigram_docs": """SELECT TERM, DOC FROM TITLES_TRIGRAM_VOCAB WHERE TERM IN (SELECT VALUE FROM json_each(?)) ORDER BY DOC, TERM;""",
+    "title_candidates": """SELECT ID, TITLE, TITLE_KEY FROM MOVIES WHERE ID IN
+             (SELECT rowid FROM TITLES_TRIGRAM WHERE TITLES_TRIGRAM MATCH ?1) ORDER BY {} DESC, length(TITLE_KEY), ID LIMIT ?2;""",
+    "has_title": """SELECT EXISTS (SELECT 1 FROM MOVIES WHERE TITLE_KEY=name_key(?));""",
+    "has_data": """SELECT EXISTS (SELECT 1 FROM MOVIES WHERE YEAR IS NOT NULL);""",
+    "queued": """SELECT ID, {} FROM MOVIES WHERE ID IN (SELECT MOVIE_ID FROM INDEX_QUEUE);""",
+    "queue_all": """INSERT OR IGNORE INTO INDEX_QUEUE SELECT ID FROM MOVIES;""",
+    "clear_queue": """DELETE FROM INDEX_QUEUE;""",
+    "unlink_people": """DELETE FROM MOVIE_PEOPLE WHERE MOVIE_ID=?;""",
+    "add_person": """INSERT OR IGNORE INTO PEOPLE (NAME, NAME_KEY) VALUES (?, ?);""",
+    "link_person": """INSERT OR IGNORE INTO MOVIE_PEOPLE (MOVIE_ID, PERSON_ID, ROLE) SELECT ?, ID, ? FROM PEOPLE WHERE NAME_KEY=?;""",
+    "unlink_facet": """DELETE FROM MOVIE_{0} WHERE MOVIE_ID=?;""",
+    "add_facet": """INSERT OR IGNORE INTO {0} (NAME, NAME_KEY) VALUES (?, ?);""",
+    "link_facet": """INSERT OR IGNORE INTO MOVIE_{0} (MOVIE_ID, FACET_ID) SELECT ?, ID FROM {0} WHERE NAME_KEY=?;""",
     "select": """SELECT {} FROM MOVIES WHERE TITLE=?;""",
-    "compare": """ SELECT TITLE, {} FROM MOVIES WHERE TITLE IN (?,?)""",
+    "compare": """ SELECT TITLE, {} FROM MOVIES WHERE TITLE_KEY IN (name_key(?), name_key(?))""",
 }
 
 DATA_MAP_VALUES = list(DATA_MAP.values())
@@ -77,48 +173,188 @@ def select():
 
 
 def update():
-    names = ", ".join(map(_update_coat, DATA_MAP_VALUES[1:]))
-    return QUERY["update"].format(names)
+    """Upsert binding a rotated row: data columns first, title last."""
+    positions = {col: i for i, col in enumerate(DATA_MAP_VALUES[1:], start=1)}
+    positions[DATA_MAP_VALUES[0]] = len(DATA_MAP_VALUES)
+    return _upsert(positions)
+
+
+def insert(*extra):
+    """Upsert of DATA_MAP columns, extra columns are bound as they are after them."""
+    positions = {col: i for i, col in enumerate(DATA_MAP_VALUES, start=1)}
+    return _upsert(positions, extra)
+
+
+def _upsert(positions, extra=()):
+    """Movie with the same title, in any case, is updated, keeping its title."""
+    cols = DATA_MAP_VALUES + list(DERIVED) + ["TITLE_KEY"] + list(extra)
+    values = [_insert_coat(col, positions[col]) for col in DATA_MAP_VALUES]
+    values.extend(f"{func}(?{positions[src]})" for func, src in DERIVED.values())
+    values.append(f"name_key(?{positions['TITLE']})")
+    values.extend(f"?{i}" for i, _ in enumerate(extra, start=len(positions) + 1))
+    updates = [f'"{col}"=excluded."{col}"' for col in cols if col not in ("TITLE", "TITLE_KEY")]
+    return QUERY["upsert"].format(
+        ", ".join(f'"{col}"' for col in cols), ", ".join(values), ", ".join(updates)
+    )
 
 
-def insert():
-    return QUERY["insert"].format(
-        ", ".join(DATA_MAP_VALUES), ", ".join(map(_insert_coat, DATA_MAP_VALUES))
+def derive():
+    """Recompute columns parsed from other columns for every row."""
+    return QUERY["derive"].format(
+        ", ".join(f'"{col}"={func}("{src}")' for col, (func, src) in DERIVED.items())
     )
 
 
-def sort(*args):
+def sort(*args, raw=False):
+    """Movies sorted by columns, with raw=True values come as they are stored."""
     try: 
         return QUERY["sort"].format(
-            _sort_cols(*args), ", ".join([f"{SORT[arg][1]} DESC" for arg in args])
+            _sort_cols(*args, raw=raw), ", ".join([f"{SORT[arg][1]} DESC" for arg in args])
         )
     except KeyError as err:
         raise ValueError(f"You can't sort by that column: {err.args[0]}.")
         
 
 
-def filter_(col):
+def filter_(col, n=1, raw=False):
     try:
-        return QUERY["filter"].format(_select_coat(FILTER[col][0]), FILTER[col][1])
+        where = FILTER[col][1].format(marks=", ".join("?" * n), n=n)
+        return QUERY["filter"].format(_select_coat(FILTER[col][0], raw), where)
     except KeyError as err:
         raise ValueError(f"You can't filter with that column: {err.args[0]}.")
 
 
-def compare(col):
+def filter_data(col, *values):
+    """Return parameters bound to filter query, falling back to defaults."""
+    if len(values) > 1 and col not in MULTI_FILTERS:
+        raise ValueError("Too many categories to filter by.")
+    if col not in FILTER_ARGS:
+        return tuple(values) or None
+    conv, default = FILTER_ARGS[col]
+    if not values:
+        if default is None:
+            raise ValueError(f"Provide a value to filter {col} by.")
+        return (default,)
+    try:
+        return tuple(dict.fromkeys(map(conv, values)))
+    except ValueError:
+        raise ValueError(f"Invalid value to filter {col} with: {', '.join(values)}.")
+
+
+def stale():
+    """Titles never fetched, older than ?1 or missing data and older than ?2."""
+    missing = " OR ".join(f'ifnull("{col}", "N/A")="N/A"' for col in DATA_MAP_VALUES)
+    return QUERY["stale"].format(missing)
+
+
+def fetched():
+    return QUERY["fetched"]
+
+
+def queued():
+    cols = list(ROLES.values()) + list(FACETS)
+    return QUERY["queued"].format(", ".join(f'"{col}"' for col in cols))
+
+
+def facet(statement, col):
+    return QUERY[statement].format(FACETS[col])
+
+
+def compare(col, raw=False):
     try:
-        return QUERY["compare"].format(COMPARE[col])
+        conv, value = COMPARE[col]
+        return QUERY["compare"].format(f"MAX({value})" if raw else f"{conv}(MAX({value}))")
     except KeyError as err:
         raise ValueError(f"You can't compare with that: {err.args[0]}.")
 
-def highscores():
-    return [QUERY["highscores"].format(sel_col, fcol) for sel_col, fcol in HIGHSCORES]
+def snapshot(*exprs):
+    return QUERY["snapshot"].format(", ".join(exprs))
+
+
+def match(words):
+    """FTS5 query matching movies holding all words. Words are quoted so
+    punctuation isn't read as query syntax, a trailing * matches prefixes."""
+    terms = []
+    for word in " ".join(words).split():
+        term = word.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if word.endswith("*") else ""))
+    if not terms:
+        raise ValueError("Provide words to search for.")
+    return " ".join(terms)
+
+
+def search(raw=False):
+    """Movies matching an FTS5 query, binds the query and the limit."""
+    if raw:
+        return QUERY["search"].format("YEAR", "MOVIES.DIRECTOR", "IMDb_Rating")
+    return QUERY["search"].format(
+        "_str(YEAR)", 'ifnull(MOVIES.DIRECTOR, "N/A")', "_str(IMDb_Rating)"
+    )
+
 
+def key_trigrams(key):
+    """Trigrams of a title key, as the trigram tokenizer indexes them."""
+    return sorted({key[i:i + 3] for i in range(len(key) - 2)})
 
-def _insert_coat(col):
-    return f"{INSERT_CONV[col.lower()]}(?)" if col.lower() in INSERT_CONV else "?"
 
+def trigram_match(grams):
+    """FTS5 query matching title keys holding any of the trigrams."""
+    return " OR ".join('"{}"'.format(gram.replace('"', '""')) for gram in grams)
+
+
+def title_candidates(n):
+    """Titles matched by ?1, those holding most of the n trigrams bound after
+    the limit ?2 first."""
+    shared = " + ".join(f"(instr(TITLE_KEY, ?{i}) > 0)" for i in range(3, n + 3))
+    return QUERY["title_candidates"].format(shared)
+
+
+def stats(group, raw=False):
+    """Number of movies, mean IMDb rating, total box office and the best rated
+    movie of every group having at least as many movies as bound."""
+    try:
+        groups, order = STATS[group]
+    except KeyError:
+        raise ValueError(f"You can't group by that: {group}. Choose from: {', '.join(STATS)}.")
+    if raw:
+        label, values = "GRP", [value for _, value in STATS_VALUES]
+    else:
+        label = "GRP || 's'" if group == "decade" else "_str(GRP)"
+        values = [f'ifnull({conv}({value}), "N/A")' for conv, value in STATS_VALUES]
+    return QUERY["stats"].format(groups, label, ", ".join(values), order)
+
+
+def highscores(raw=False):
+    """Top rows of every category, binds number of places, ties included.
+    A row places if its key reaches the key of the last place, both are
+    read from the sort index of the key."""
+    places = " UNION ALL ".join(
+        QUERY["highscore"].format(i, cat, key if raw else f"_str({conv}({key}))", key)
+        for i, (cat, (conv, key)) in enumerate(HIGHSCORES.items())
+    )
+    return QUERY["highscores"].format(places)
 
-def _select_coat(col):
+
+def sort_indexes():
+    """Index name: key of every SORT and HIGHSCORES column. Keys are indexed
+    descending, ties come in ID order, as sort() and highscores() want them."""
+    keys = [key for _, key in SORT.values()] + [key for _, key in HIGHSCORES.values()]
+    return {
+        "movies_sort_" + re.sub(r"\W+", "_", key.replace('"', "")).strip("_").lower(): key
+        for key in keys
+    }
+
+
+def _insert_coat(col, pos=""):
+    return (
+        f"{INSERT_CONV[col.lower()]}(?{pos})" if col.lower() in INSERT_CONV else f"?{pos}"
+    )
+
+
+def _select_coat(col, raw=False):
+    if raw:
+        return f'"{col}"'
     return (
         f'ifnull({SELECT_CONV[col.lower()]}("{col}"), "N/A")'
         if col.lower() in SELECT_CONV
@@ -130,14 +366,6 @@ def _sort_coat(col):
     return f'ifnull({SORT[col][0]}, "N/A")'
 
 
-def _update_coat(col):
-    return (
-        f'"{col}"={INSERT_CONV[col.lower()]}(?)'
-        if col.lower() in INSERT_CONV
-        else f'"{col}"=?'
-    )
-
-
 def _sel_cols(*args):
     args = list(args)
     if "title" in args:
@@ -147,10 +375,12 @@ def _sel_cols(*args):
     return ""
 
 
-def _sort_cols(*args):
+def _sort_cols(*args, raw=False):
     args = list(args)
     if "title" in args:
         args.remove("title")
+    if raw:
+        return "".join(f", {SORT[arg][1]}" for arg in args)
     if args:
         return iadd(", ", ", ".join([f'ifnull({SORT[arg][0]}, "N/A")' for arg in args]))
     return ""
@@ -1,10 +1,12 @@
 import re
+from movies.tools import name_key
 
 
 def register_functions(con):
-    """Register functions in SQLite."""
+    """Register functions in SQLite. They are all pure, registered as
+    deterministic they can be used in expression indexes."""
     for func in FUNCMAP:
-        con.create_function(func, FUNCMAP[func][0], FUNCMAP[func][1])
+        con.create_function(func, FUNCMAP[func][0], FUNCMAP[func][1], deterministic=True)
 
 def nominations(sentence):
     """Return the number of nominations, excluding Oscars."""
@@ -138,12 +140,20 @@ def _int(value):
 def _str(value):
     return str(value) if value else "N/A"
 
+def _float(value):
+    """Float of a number or numeric string, None for "N/A" and other text."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
 
 FUNCMAP = {
     "str": (1, str),
     "float": (1, float),
     "_int": (1, _int),
     "_str": (1, _str),
+    "_float": (1, _float),
     "int": (1, int),
     "nominations": (1, nominations),
     "awards_won": (1, awards_won),
@@ -157,4 +167,5 @@ FUNCMAP = {
     "int_to_account": (1, int_to_account),
     "int_to_comas": (1, int_to_comas),
     "has_osc_nom": (1, has_osc_nom),
+    "name_key": (1, name_key),
 }
@@ -0,0 +1,64 @@
+import csv
+import json
+import sys
+
+FORMATS = ("csv", "jsonl", "tsv")
+
+
+def header(columns):
+    """Column names of query rows, title always comes first."""
+    columns = [col for col in columns if col != "title"]
+    return ["title"] + columns
+
+
+def records(rows, cols):
+    """Rows as dicts keyed by column names."""
+    return (dict(zip(cols, row)) for row in rows)
+
+
+def write(rows, cols, fmt, stream):
+    """Write rows to stream as they come, return number of written rows."""
+    check_format(fmt)
+    if fmt == "jsonl":
+        count = 0
+        for record in records(rows, cols):
+            stream.write(json.dumps(record, ensure_ascii=False))
+            stream.write("\n")
+            count += 1
+        return count
+    counter = _Counter(rows)
+    writer = csv.writer(
+        stream, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n"
+    )
+    writer.writerow(cols)
+    writer.writerows(counter)
+    return counter.count
+
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(
+            f"Unknown output format: {fmt}. Choose from: {', '.join(FORMATS)}."
+        )
+
+
+def export(rows, cols, fmt, filepath=None):
+    """Write rows to a file, or to stdout if filepath is not given."""
+    check_format(fmt)
+    if filepath is None:
+        count = write(rows, cols, fmt, sys.stdout)
+        sys.stdout.flush()
+        return count
+    with open(filepath, "w", newline="", encoding="utf-8") as stream:
+        return write(rows, cols, fmt, stream)
+
+
+class _Counter:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
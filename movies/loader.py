@@ -0,0 +1,59 @@
+import json
+from collections import Counter
+from movies.conf import DATA_MAP
+from movies.requester import row
+from movies.tools import content_hash, name_key
+
+FETCH_COLUMNS = ("LAST_FETCHED", "CONTENT_HASH")
+
+
+def read_records(filepath):
+    """Yield OMDb records of a JSON Lines file, or of a JSON file holding a list
+    of records or a single one. JSON Lines files are read line by line, a
+    malformed line gives None, which load_rows() counts as invalid.
+    """
+    with open(filepath, encoding="utf-8") as f:
+        if filepath.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        yield None
+            return
+        data = json.load(f)
+    yield from data if isinstance(data, list) else [data]
+
+
+def read_titles(filepath):
+    """Titles or IMDb ids listed one per line, blank lines are skipped."""
+    with open(filepath, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_rows(records, known, now, skipped=None):
+    """Rows for query.insert(*FETCH_COLUMNS), records with title keys in known
+    and invalid records are left out and counted in skipped.
+    """
+    skipped = Counter() if skipped is None else skipped
+    for record in records:
+        if not valid(record):
+            skipped["invalid"] += 1
+            continue
+        key = name_key(record["Title"])
+        if key in known:
+            skipped["duplicate"] += 1
+            continue
+        known.add(key)
+        movie = row(record)
+        yield movie + (now, content_hash(movie[1:]))
+
+
+def valid(record):
+    """OMDb records hold every value as a string, "N/A" if it's missing."""
+    return (
+        isinstance(record, dict)
+        and record.get("Response", "True") != "False"
+        and bool(record.get("Title"))
+        and all(isinstance(record.get(col, "N/A"), str) for col in DATA_MAP)
+    )
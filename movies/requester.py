@@ -1,12 +1,31 @@
 import json
 import os
+import re
+import hashlib
 import concurrent.futures
 import requests
-from movies.conf import DATA_MAP, SITE
+from requests.adapters import HTTPAdapter
+from movies.cache import ResponseCache, cache_key
+from movies.conf import (
+    DATA_MAP,
+    SITE,
+    WORKERS,
+    POOL_SIZE,
+    TIMEOUT,
+    CACHE_FP,
+    CACHE_TTL,
+    CACHE_NEGATIVE_TTL,
+    CACHE_SIZE,
+    CREDENTIALS_TTL,
+)
+
+
+IMDB_ID_RE = re.compile(r"tt\d{7,}$")
 
 
 class Credentials:
-    def __init__(self, creds=None, key=None):
+    def __init__(self, creds=None, key=None, cache=None):
+        self.cache = cache
         if creds:
             self.creds = self._load_creds(creds)
         elif key:
@@ -35,10 +54,16 @@ class Credentials:
         return self._check_response(creds)
 
     def _check_response(self, creds):
+        """Validate key against OMDb, positive answers are cached for CREDENTIALS_TTL."""
+        cached_key = self.cache_key(creds["apikey"])
+        if self.cache and self.cache.get(cached_key):
+            return creds
         error = None
         try:
-            response_code = requests.get(SITE, params=creds).status_code
+            response_code = requests.get(SITE, params=creds, timeout=TIMEOUT).status_code
             if response_code == 200:
+                if self.cache:
+                    self.cache.put(cached_key, True, ttl=CREDENTIALS_TTL)
                 return creds
             raise ValueError(
                 f"Invalid response code: {response_code}, while checking your creds. Provide valid credentials."
@@ -51,26 +76,67 @@ class Credentials:
                     f"While trying to check your credentials an error happened: {error}"
                 )
 
+    @staticmethod
+    def cache_key(apikey):
+        return "apikey:" + hashlib.sha1(str(apikey).encode()).hexdigest()
+
     def apikey(self):
         return self.creds["apikey"]
 
 
 class Requester:
-    def __init__(self, credentials):
-        self.site = SITE
+    def __init__(
+        self,
+        credentials,
+        workers=WORKERS,
+        pool_size=POOL_SIZE,
+        timeout=TIMEOUT,
+        site=SITE,
+        cache=None,
+    ):
+        self.site = site
         self.key = credentials
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = cache
+        self.session = self._session(pool_size)
+
+    def _session(self, pool_size):
+        """Keep-alive connections shared by all workers, at most pool_size open."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
-    def request_many(self, titles, messages=False):
+    def close(self):
+        self.session.close()
+        if self.cache:
+            self.cache.close()
+
+    def request_many(
+        self, titles, messages=False, fresh=False, errors=None, callback=None
+    ):
+        """Responses in order of titles. When errors list is given failed titles
+        are appended to it as (title, message) instead of raising. Callback is
+        called with title and response of every found movie, downloaded ones
+        from worker threads as soon as they arrive."""
         if messages:
             print("\nDownloading data, please wait...")
+        responses, failed = self._responses(
+            titles, fresh=fresh, errors=errors, callback=callback
+        )
         data = []
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            promises = {
-                executor.submit(self._get_request, title): title for title in titles
-            }
-            for promise in concurrent.futures.as_completed(promises):
-                result = promise.result()
-                data.append(result)
+        for title in titles:
+            try:
+                key = cache_key(title)
+                if key in failed:
+                    raise ValueError(failed[key])
+                data.append(self._check(title, responses[key]))
+            except ValueError as err:
+                if errors is None:
+                    raise
+                errors.append((title, ", ".join(err.args)))
         if messages:
             print("Data downloaded succesfully.")
         return data
@@ -78,8 +144,50 @@ class Requester:
     def request(self, title):
         return self._get_request(title)
 
-    def _get_request(self, title):
+    def _responses(self, titles, fresh=False, errors=None, callback=None):
+        """Cached responses plus one download per distinct title missing from cache."""
+        keys = {}
+        for title in titles:
+            keys.setdefault(cache_key(title), title)
+        responses = self.cache.get_many(keys) if self.cache and not fresh else {}
+        if callback:
+            for key, response in responses.items():
+                self._notify(callback, keys[key], response)
+        fetched, failed = {}, {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                promises = {
+                    executor.submit(self._fetch, title, callback): key
+                    for key, title in keys.items()
+                    if key not in responses
+                }
+                for promise in concurrent.futures.as_completed(promises):
+                    try:
+                        fetched[promises[promise]] = promise.result()
+                    except ValueError as err:
+                        if errors is None:
+                            raise
+                        failed[promises[promise]] = ", ".join(err.args)
+        finally:
+            if self.cache and fetched:
+                self.cache.store(fetched)
+        responses.update(fetched)
+        return responses, failed
+
+    def _fetch(self, title, callback=None):
         response = self._request(title)
+        if callback:
+            self._notify(callback, title, response)
+        return response
+
+    def _notify(self, callback, title, response):
+        if response.get("Response") != "False":
+            callback(title, response)
+
+    def _get_request(self, title):
+        return self._check(title, self._responses([title])[0][cache_key(title)])
+
+    def _check(self, title, response):
         if response.get("Response") == "False":
             response_info = response.get("Error", "unknown")
             msg = f"Download of {title} failed to: {response_info}"
@@ -89,7 +197,9 @@ class Requester:
     def _request(self, title):
         error = None
         try:
-            return requests.get(self.site, params=self._params(title)).json()
+            return self.session.get(
+                self.site, params=self._params(title), timeout=self.timeout
+            ).json()
         except Exception as err:
             error = err
         finally:
@@ -97,12 +207,33 @@ class Requester:
                 raise ValueError(f"Connection to a server failed due to {error}")
 
     def _params(self, title):
+        """IMDb ids, like tt0111161, are looked up by id, anything else by title."""
+        if IMDB_ID_RE.match(title):
+            return {"i": title, "apikey": self.key}
         return {"t": title, "apikey": self.key}
 
 
 class Downloader:
-    def __init__(self, credentials):
-        self.req = Requester(Credentials(credentials).apikey())
+    def __init__(
+        self,
+        credentials,
+        workers=WORKERS,
+        pool_size=POOL_SIZE,
+        timeout=TIMEOUT,
+        cache_fp=CACHE_FP,
+    ):
+        cache = (
+            ResponseCache(cache_fp, CACHE_TTL, CACHE_NEGATIVE_TTL, CACHE_SIZE)
+            if cache_fp
+            else None
+        )
+        self.req = Requester(
+            Credentials(credentials, cache=cache).apikey(),
+            workers=workers,
+            pool_size=pool_size,
+            timeout=timeout,
+            cache=cache,
+        )
 
     def download_one(self, title, process=False, rotated=False):
         data = self.req.request(title)
@@ -112,8 +243,22 @@ class Downloader:
             return row(data)
         return data
 
-    def download_many(self, titles, process=False, rotated=False):
-        data = self.req.request_many(titles)
+    def download_many(
+        self,
+        titles,
+        process=False,
+        rotated=False,
+        fresh=False,
+        errors=None,
+        callback=None,
+    ):
+        """Callback gets title and data of every found movie, processed like the
+        returned data."""
+        if callback and process:
+            callback = _processed(callback, rotated_row if rotated else row)
+        data = self.req.request_many(
+            titles, fresh=fresh, errors=errors, callback=callback
+        )
         if process:
             if rotated:
                 return rotated_rows(data)
@@ -121,6 +266,10 @@ class Downloader:
         return data
 
 
+def _processed(callback, convert):
+    return lambda title, data: callback(title, convert(data))
+
+
 def row(data):
     return tuple(data.get(col, "N/A") for col in DATA_MAP)
 
@@ -0,0 +1,143 @@
+import json
+import sqlite3 as sq3
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from movies.utils import Commander
+from movies.conf import SERVER_HOST, SERVER_PORT
+
+
+def _rows(result):
+    """Commander returns rows as records, messages and errors as strings."""
+    if isinstance(result, str):
+        raise ValueError(result)
+    return {"rows": result}
+
+
+def _required(params, name):
+    if not params.get(name):
+        raise ValueError(f"Provide the {name} parameter.")
+    return params[name]
+
+
+def _sort_by(cmd, params):
+    return _rows(cmd.sort_by(*_required(params, "by")))
+
+
+def _filter_by(cmd, params):
+    return _rows(cmd.filter_by(_required(params, "by")[:1] + params.get("value", [])))
+
+
+def _compare(cmd, params):
+    movies = params.get("movie", [])
+    if len(params.get("by", [])) != 1 or len(movies) != 2:
+        raise ValueError("Provide one category and two movies to compare.")
+    return _rows(cmd.compare(params["by"][0], *movies))
+
+
+def _highscores(cmd, params):
+    return _rows(cmd.highscores(int(params.get("top", ["1"])[0])))
+
+
+def _search(cmd, params):
+    return _rows(cmd.search(*params.get("q", [])))
+
+
+def _add_movie(cmd, params):
+    titles = params.get("title", [])
+    if len(titles) != 1:
+        raise ValueError("Provide one title to add.")
+    message = cmd.add_movie(titles[0])
+    if message != "Movie added.":
+        raise ValueError(message)
+    return {"message": message}
+
+
+GET = {
+    "/sort_by": _sort_by,
+    "/filter_by": _filter_by,
+    "/compare": _compare,
+    "/highscores": _highscores,
+    "/search": _search,
+}
+
+POST = {
+    "/add": _add_movie,
+}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Commander modes as JSON endpoints. Query parameters are named like
+    /sort_by?by=year&by=runtime, /filter_by?by=director&value=<name>,
+    /compare?by=imdb&movie=<title>&movie=<title>, /highscores?top=3, /search?q=<words> and
+    POST /add?title=<title>.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without it keep-alive clients wait for delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle(GET)
+
+    def do_POST(self):
+        self._handle(POST)
+
+    def _handle(self, routes):
+        url = urlparse(self.path)
+        if url.path not in routes:
+            return self._reply(404, {"error": f"Unknown endpoint: {url.path}."})
+        lock = self.server.write_lock if routes is POST else nullcontext()
+        try:
+            with lock:
+                data = routes[url.path](self.server.commander, parse_qs(url.query))
+        except (ValueError, TypeError) as err:
+            return self._reply(400, {"error": ", ".join(map(str, err.args))})
+        except sq3.Error as err:
+            return self._reply(500, {"error": f"Database error: {err}."})
+        self._reply(200, data)
+
+    def _reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    """One warm Commander, with pooled connections, shared by all requests.
+    Queries run in parallel, movies are added one at a time."""
+
+    daemon_threads = True
+
+    def __init__(self, commander=None, host=SERVER_HOST, port=SERVER_PORT):
+        super().__init__((host, port), QueryHandler)
+        self.commander = commander or Commander(output="records", pooled=True)
+        # Connect, and download data if needed, before the first request.
+        self.commander.db_api
+        self.write_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, **settings):
+    """Serve until interrupted, settings are passed to Commander."""
+    commander = Commander(**dict(settings, output="records", pooled=True))
+    server = QueryServer(commander, host, port)
+    print(f"Serving on {server.url}, press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.commander.db_api.close()
@@ -1,4 +1,5 @@
-from itertools import chain
+import hashlib
+from itertools import chain, islice
 
 def limsplit(strg, lim, splitter):
     """It takes a string and it splits it from left to right, with kept order, and with parts not exceeding length limit but as close to it as possible.
@@ -12,6 +13,46 @@ def limsplit(strg, lim, splitter):
             splits.append([split]) 
     return list(map(splitter.join, chain(splits if splits[0] else splits[1:])))
 
+def split_names(strg, splitter=","):
+    """Split comma joined list, skipping blanks and missing values.
+    split_names("John, Mary,  ,N/A") => ["John", "Mary"]
+    """
+    if not strg:
+        return []
+    names = (name.strip() for name in strg.split(splitter))
+    return [name for name in names if name and name != "N/A"]
+
+def name_key(name):
+    """Normalize name for case insensitive lookups, None stays None."""
+    if name is None:
+        return None
+    return " ".join(name.split()).casefold()
+
+def trigrams(key):
+    """Character trigrams of a name key, padded so that word edges count.
+    trigrams("heat") => {"  h", " he", "hea", "eat", "at "}
+    """
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(key1, key2):
+    """Share of trigrams two name keys have in common, from 0 to 1."""
+    grams1, grams2 = trigrams(key1), trigrams(key2)
+    return len(grams1 & grams2) / len(grams1 | grams2)
+
+def content_hash(values):
+    """Stable digest of row values, used to tell whether downloaded data changed."""
+    return hashlib.sha1("\x1f".join(map(str, values)).encode()).hexdigest()
+
+def batches(iterable, size):
+    """Split iterable into lists of given size, the last one may be shorter."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 def wrapper(func, statement):
     return f"{func}({statement})"
 
@@ -1,53 +1,189 @@
+import math
 import re
-import os.path
+import shutil
 import sys
-import hashlib
+import time
 from operator import iadd, methodcaller
-from itertools import chain, zip_longest
-from movies.tools import limsplit
-from movies.conf import INITIAL_DB_CHECKSUM, DB_FP, CREDENTIALS, DATA_MAP
+from itertools import chain, zip_longest, islice
+from movies.tools import limsplit, content_hash, name_key
+from movies.conf import (
+    CREDENTIALS,
+    DATA_MAP,
+    WORKERS,
+    POOL_SIZE,
+    TIMEOUT,
+    CACHE_FP,
+    QUERY_CACHE_FP,
+    QUERY_CACHE_TTL,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_ROWS,
+    REFRESH_AGE,
+    MISSING_AGE,
+    SEARCH_LIMIT,
+    NOT_FOUND,
+)
 import movies.db.query as query
 import movies.db.dbm as dbm
-from movies.requester import Downloader
 
 
 class Commander:
-    def __init__(self, ignore_checksum=False):
-        self.ignore_checksum = ignore_checksum
-        self.db_api = dbm.DatabaseManager()
-        self.printer = DataPrinter()
-        self.downloader = None
-        self.populate_db()
+    def __init__(
+        self,
+        repopulate=False,
+        workers=WORKERS,
+        pool_size=POOL_SIZE,
+        timeout=TIMEOUT,
+        cache_fp=CACHE_FP,
+        output=None,
+        output_fp=None,
+        readonly=False,
+        pooled=False,
+        query_cache_fp=QUERY_CACHE_FP,
+        analytics=False,
+    ):
+        self.repopulate = repopulate
+        self.readonly = readonly
+        self.pooled = pooled
+        self.output = output
+        self.output_fp = output_fp
+        self.dl_settings = {
+            "workers": workers,
+            "pool_size": pool_size,
+            "timeout": timeout,
+            "cache_fp": cache_fp,
+        }
+        self.query_cache_fp = query_cache_fp
+        self.analytics = analytics
+        self._snapshot = None
+        self._db_api = None
+        self._printer = None
+        self._downloader = None
+        self._results = None
+
+    @property
+    def db_api(self):
+        """Connection is opened, and db populated if needed, on first use."""
+        if self._db_api is None:
+            self._db_api = self._connect_db(self.readonly)
+            if self.readonly and not self.populated():
+                # Data is downloaded on first run, it needs a writer.
+                self._db_api.close()
+                self._db_api = self._connect_db()
+            self.populate_db()
+        return self._db_api
+
+    @property
+    def raw(self):
+        """Exported files get values as they are stored, tables and records formatted."""
+        return self.output not in (None, "records")
+
+    @property
+    def printer(self):
+        if self._printer is None:
+            self._printer = DataPrinter()
+        return self._printer
+
+    @property
+    def downloader(self):
+        if self._downloader is None:
+            self._downloader = self.start_dl()
+        return self._downloader
+
+    @property
+    def results(self):
+        """Cache of query results, None if disabled."""
+        if self._results is None and self.query_cache_fp:
+            from movies.cache import QueryCache
+
+            self._results = QueryCache(
+                self.query_cache_fp, QUERY_CACHE_TTL, QUERY_CACHE_SIZE, QUERY_CACHE_ROWS
+            )
+        return self._results
+
+    @property
+    def snapshot(self):
+        """NumPy snapshot of numeric columns, loaded again after the data changed."""
+        from movies.analytics import Snapshot
+
+        if self._snapshot is None or self._snapshot.version != self.db_api.data_version():
+            self._snapshot = Snapshot.load(self.db_api)
+        return self._snapshot
 
     def start_dl(self):
+        from movies.requester import Downloader
+
         try:
-            return Downloader(credentials=CREDENTIALS)
+            return Downloader(credentials=CREDENTIALS, **self.dl_settings)
         except ValueError as err:
             raise ValueError(
                 f'An error occured while trying to download data: {", ".join(err.args)}'
             )
 
-    def _verify_db_checksum(self, filepath=DB_FP):
-        if not os.path.isfile(DB_FP):
-            raise ValueError(f"error: {DB_FP} not found.")
-        checksum = hashlib.sha1()
-        with open(filepath, "rb") as file_:
-            for chunk in iter(lambda: file_.read(4096), b""):
-                checksum.update(chunk)
-        return checksum.hexdigest() == INITIAL_DB_CHECKSUM
+    def _connect_db(self, readonly=False):
+        try:
+            if self.pooled:
+                from movies.db.pool import PooledDatabaseManager
+
+                return PooledDatabaseManager()
+            return dbm.DatabaseManager(readonly=readonly)
+        except ValueError as err:
+            raise ValueError(f'An error during db operations: {", ".join(err.args)}')
 
     def populate_db(self):
+        """Download all movies once, population state is kept in META table."""
         try:
-            if self.ignore_checksum or self._verify_db_checksum():
-                self.downloader = self.start_dl()
-                self._dl_upload()
+            if not self.populated():
+                # A population cut short only downloads the titles it didn't get.
+                age = 0 if self.repopulate else math.inf
+                _, _, errors = self._dl_upload(age, age)
+                for _, msg in errors:
+                    print(msg, file=sys.stderr)
+                if all(msg.endswith(NOT_FOUND) for _, msg in errors):
+                    self.db_api.set_meta("populated", 1)
         except ValueError as err:
             raise ValueError(f'An error during db operations: {", ".join(err.args)}')
 
-    def _dl_upload(self):
-        titles = dbm.get_titles()
-        movie_data = self.downloader.download_many(titles, process=True, rotated=True)
-        self.db_api.insert_many(query.update(), movie_data)
+    def populated(self):
+        return not self.repopulate and bool(self.db_api.meta("populated"))
+
+    def refresh(self, max_age=REFRESH_AGE, missing_age=MISSING_AGE):
+        """Download movies fetched more than max_age seconds ago, or missing data
+        and fetched more than missing_age ago. Only changed rows are rewritten.
+        """
+        try:
+            fetched, changed, errors = self._dl_upload(max_age, missing_age)
+            summary = [
+                f"Refreshed {fetched} movies: {changed} updated, {fetched - changed} unchanged."
+            ]
+            summary.extend(msg for _, msg in errors)
+            return "\n".join(summary)
+        except ValueError as err:
+            return ", ".join(err.args)
+
+    def _dl_upload(self, max_age=0, missing_age=0):
+        now = time.time()
+        hashes = dict(
+            self.db_api.select_one(query.stale(), (now - max_age, now - missing_age))
+        )
+        if not hashes:
+            return 0, 0, []
+        errors = []
+        rows = self.downloader.download_many(
+            list(hashes), process=True, fresh=True, errors=errors
+        )
+        failed = {title for title, _ in errors}
+        titles = [title for title in hashes if title not in failed]
+        # Titles OMDb doesn't know wait for the next refresh, failed connections are retried.
+        fetched = [(now, hashes[title], title) for title, msg in errors if msg.endswith(NOT_FOUND)]
+        changed = []
+        for title, row in zip(titles, rows):
+            digest = content_hash(row[1:])
+            fetched.append((now, digest, title))
+            if digest != hashes[title]:
+                changed.append(row[1:] + (title,))
+        self.db_api.insert_many(query.update(), changed)
+        self.db_api.insert_many(query.fetched(), fetched)
+        return len(titles), len(changed), errors
 
     def sort_by(self, *args):
         """Sort movies by column(s)"""
@@ -55,64 +191,236 @@ class Commander:
             args_ = set(args)
             if len(args_) != len(args):
                 return "Please provide unique sorting parameters."
-            data = self.db_api.select_one(query.sort(*args))
-            return self.printer.display(data, args)
+            if self.analytics:
+                data = iter(self.snapshot.sort(*args, raw=self.raw))
+            else:
+                data = self._select(query.sort(*args, raw=self.raw))
+            return self._show(data, args)
         except ValueError as err:
             return ", ".join(err.args)
 
     def filter_by(self, category):
         """Filter data by a category."""
         try:
-            if len(category) == 1:
-                data = self.db_api.select_one(query.filter_(category[0]))
-            elif len(category) == 2:
-                data = self.db_api.select_one(
-                    query.filter_(category[0]), tuple([category[1]])
-                )
-            else:
-                raise ValueError("Too many categories to filter by.")
-            if not data:
+            values = query.filter_data(*category)
+            data = self._select(
+                query.filter_(category[0], len(values or ()), self.raw), values
+            )
+            first = next(data, None)
+            if first is None:
                 return "No movie match this restriction."
-            return self.printer.display(data, columns=[category[0]])
+            return self._show(chain([first], data), [category[0]])
         except ValueError as err:
             return ", ".join(err.args)
 
     def compare(self, category, movie1, movie2):
         """Compare two movies by a category."""
         try:
-            data = self.db_api.select_one(
-                query.compare(category), data=(movie1, movie2), check=True
-            )
-            if not data[0][1] or data[0][1] == "N/A":
+            titles = [self.db_api.resolve_title(movie)[1] for movie in (movie1, movie2)]
+            data = list(self._select(query.compare(category, self.raw), titles))
+            if data[0][1] in (None, "", "N/A"):
                 raise ValueError(
                     "Can't compare movies in that category, due to lack of data."
                 )
-            return self.printer.display(data, columns=[category])
+            return self._show(data, [category])
         except ValueError as err:
             return ", ".join(err.args)
 
     def add_movie(self, title):
         """Add movie to the database. Print msg if it's not found."""
         try:
-            if not self.downloader:
-                self.downloader = self.start_dl()
+            stored = self.db_api.find_title(title, fuzzy=False)
+            if stored is not None:
+                raise ValueError(f"Error: Movie is in DB as {stored[1]}.")
             movie_data = self.downloader.download_one(title, process=True)
             self.db_api.insert_one(query.insert(), data=movie_data, check=True)
             return "Movie added."
         except ValueError as err:
             return ", ".join(err.args)
 
-    def highscores(self):
-        """Return highest value from columns:\n
+    def add_movies(self, titles):
+        """Add movies by titles or IMDb ids. Missing ones are downloaded
+        concurrently and stored in one transaction. Return a line per title.
+        Titles of one movie, given or downloaded, are added once."""
+        try:
+            titles = list(dict.fromkeys(titles))
+            results = dict.fromkeys(titles)
+            known = set(self.db_api.stored(titles))
+            new, first = [], {}
+            for title in titles:
+                key = name_key(title)
+                if title in known:
+                    results[title] = "already in database."
+                elif key in first:
+                    results[title] = f"same movie as {first[key]}."
+                else:
+                    first[key] = title
+                    new.append(title)
+            errors = []
+            movies = self.downloader.download_many(new, process=True, errors=errors)
+            failed = dict(errors)
+            found = [title for title in new if title not in failed]
+            results.update(failed)
+            stored = set(self.db_api.stored(movie[0] for movie in movies))
+            added, first = [], {}
+            for title, movie in zip(found, movies):
+                key = name_key(movie[0])
+                if movie[0] in stored:
+                    results[title] = f"already in database as {movie[0]}."
+                elif key in first:
+                    results[title] = f"same movie as {first[key]}."
+                else:
+                    first[key] = title
+                    results[title] = "added." if movie[0] == title else f"added as {movie[0]}."
+                    added.append(movie)
+            self.db_api.insert_many(query.insert(), added)
+            summary = [f"{title}: {result}" for title, result in results.items()]
+            summary.append(f"Added {len(added)} of {len(results)} movies.")
+            return "\n".join(summary)
+        except ValueError as err:
+            return ", ".join(map(str, err.args))
+
+    def add_file(self, filepath):
+        """Add movies listed in a file, one title or IMDb id per line."""
+        from movies.loader import read_titles
+
+        try:
+            return self.add_movies(read_titles(filepath))
+        except OSError as err:
+            return f"Can't read {filepath}: {err.strerror}."
+
+    def import_movies(self, filepath):
+        """Load a local JSON or JSON Lines file of OMDb records into the database."""
+        from collections import Counter
+        from movies import loader
+
+        try:
+            if self._db_api is None:
+                # Importing is an offline alternative to downloading, db isn't populated.
+                self._db_api = self._connect_db()
+            skipped = Counter()
+            rows = loader.load_rows(
+                loader.read_records(filepath),
+                set(map(name_key, self.db_api.get_titles())),
+                time.time(),
+                skipped,
+            )
+            count = self.db_api.bulk_insert(query.insert(*loader.FETCH_COLUMNS), rows)
+            # Imported movies are as fresh as downloaded ones, refresh updates them.
+            self.db_api.set_meta("populated", 1)
+            return (
+                f"Imported {count} movies, skipped {skipped['duplicate']} already in "
+                f"database and {skipped['invalid']} invalid records."
+            )
+        except OSError as err:
+            return f"Can't read {filepath}: {err.strerror}."
+        except ValueError as err:
+            return ", ".join(map(str, err.args))
+
+    def highscores(self, top=1):
+        """Return highest values from columns:\n
         Runtime, Box office earnings, Most awards won,\n
-        Most nominations, Most Oscars, Highest IMDB Rating.
+        Most nominations, Most Oscars, Highest IMDB Rating.\n
+        Top places of every category, with ties, read from indexes of their keys.
         """
         try:
-            data = self.db_api.select_many(query.highscores())
+            if top < 1:
+                raise ValueError("Number of places has to be positive.")
+            if self.analytics:
+                data = self.snapshot.highscores(top, raw=self.raw)
+            else:
+                data = list(self._select(query.highscores(self.raw), (top,)))
+            if self.output:
+                return self._export(data, ["category", "title", "value"])
             return self.printer.print_highscores(data)
         except ValueError as err:
             return ", ".join(err.args)
 
+    def percentiles(self, column, *percents):
+        """Percentiles of a numeric column, computed on the NumPy snapshot."""
+        try:
+            percents = [float(p) for p in percents] or [25, 50, 75, 90]
+            if any(p < 0 or p > 100 for p in percents):
+                raise ValueError("Percentiles have to be between 0 and 100.")
+            data = self.snapshot.percentiles(column, percents)
+            rows = data if self.raw else [(f"{p:g}", f"{value:g}") for p, value in data]
+            return self._show_stats(rows, ["percentile", column])
+        except ValueError as err:
+            return ", ".join(map(str, err.args))
+
+    def histogram(self, column, bins=10):
+        """Counts of movies in equal width ranges of a numeric column."""
+        try:
+            bins = int(bins)
+            if bins < 1:
+                raise ValueError("Number of bins has to be positive.")
+            data = self.snapshot.histogram(column, bins)
+            if not self.raw:
+                data = [(f"{low:g}", f"{high:g}", str(count)) for low, high, count in data]
+            return self._show_stats(data, ["from", "to", "movies"])
+        except ValueError as err:
+            return ", ".join(map(str, err.args))
+
+    def search(self, *words):
+        """Movies matching all words in title, people, genre or awards, best matches first."""
+        try:
+            data = self._select(query.search(self.raw), (query.match(words), SEARCH_LIMIT))
+            first = next(data, None)
+            if first is None:
+                return "No movie match these words."
+            return self._show(chain([first], data), ["year", "director", "imdb"])
+        except ValueError as err:
+            return ", ".join(err.args)
+
+    def stats(self, group, min_movies=1):
+        """Aggregates of every group of movies, in one query."""
+        try:
+            min_movies = int(min_movies)
+            data = list(self._select(query.stats(group, self.raw), (min_movies,)))
+            cols = [group, "movies", "mean_rating", "box_office", "best_movie"]
+            return self._show_stats(data, cols)
+        except ValueError as err:
+            return ", ".join(map(str, err.args))
+
+    def _show_stats(self, rows, cols):
+        if not rows:
+            return "No data to compute it from."
+        if self.output:
+            return self._export(rows, cols)
+        return self.printer.fold(rows, [col.replace("_", " ").capitalize() for col in cols])
+
+    def _select(self, sql, data=None, check=False):
+        """Rows of a query, read from the results cache if the database didn't
+        change since they were stored."""
+        version = self.db_api.data_version()
+        if self.results is None or version is None:
+            return self.db_api.iter_select(sql, data, check)
+        key = self.results.key(version, sql, data)
+        rows = self.results.rows(key)
+        if rows is not None:
+            return iter(rows)
+        return self.results.store(key, self.db_api.iter_select(sql, data, check))
+
+    def _show(self, data, columns):
+        """Print rows as a table, or export them if output format was chosen.
+        With "records" output rows are returned as a list of dicts."""
+        if self.output:
+            from movies import export
+
+            return self._export(data, export.header(columns))
+        return self.printer.display(data, columns=columns)
+
+    def _export(self, data, cols):
+        from movies import export
+
+        if self.output == "records":
+            return list(export.records(data, cols))
+        try:
+            count = export.export(data, cols, self.output, self.output_fp)
+        except OSError as err:
+            raise ValueError(f"Can't write to {self.output_fp or 'stdout'}: {err.strerror}.")
+        return f"Exported {count} rows."
+
 
 class DataPrinter:
     def __init__(
@@ -123,7 +431,9 @@ class DataPrinter:
         rows_pp=50,
         line_sym="-",
         hide_sym=":",
+        interactive=None,
     ):
+        self.interactive = sys.stdin.isatty() if interactive is None else interactive
         self.rows_pp = rows_pp
         self.max_rows = max_rows
         self.line_sym = line_sym
@@ -134,6 +444,7 @@ class DataPrinter:
             "language": "Language",
             "director": "Director",
             "actor": "Actor",
+            "people": "Actors",
             "eighty": "Movies that won more than 80% of their nominations. Awards information.",
             "imdb": "IMDb Rating",
             "boxoffice": "Box office earnings",
@@ -150,11 +461,9 @@ class DataPrinter:
             "lanugages": "Languages",
         }
 
-    def _flatten(self, data):
-        return list(chain(*data)) if isinstance(data[0], list) else data
-
     def terminal_display(self):
-        return os.popen("stty size", "r").read().split()
+        size = shutil.get_terminal_size()
+        return [size.lines, size.columns]
 
     def column_order(self, columns):
         columns = list(columns)
@@ -188,12 +497,13 @@ class DataPrinter:
         return cols_map
 
     def unfolded_rows(self, rows, table_widths):
-        added_margins = self.add_margins(rows, table_widths)
-        added_vertlines = self.add_vertlines(added_margins)
+        return "\n".join(self.unfolded_lines(rows, table_widths))
+
+    def unfolded_lines(self, rows, table_widths):
         horizontal = self.hzline(table_widths, margin=True)
-        ready_rows = [iadd(vertline, horizontal) for vertline in added_vertlines]
-        all_ = "\n".join(ready_rows)
-        return all_
+        for row in rows:
+            vertline = self.add_vertlines(self.add_margins([row], table_widths))[0]
+            yield iadd(vertline, horizontal)
 
     def create_unfolded_table(self, rows, cols, table_widths):
         data = self.unfolded_rows(rows, table_widths)
@@ -210,14 +520,31 @@ class DataPrinter:
         return [data if bool_map[i] else 0 for i, data in enumerate(data_map)]
 
     def fold(self, rows, cols):
+        return "\n".join(self.iter_fold(rows, cols))
+
+    def iter_fold(self, rows, cols):
+        """Yield table header, then every row as soon as it is formatted."""
         cols_widths, rows_widths = self.cols_widths(cols), self.data_widths(rows)
         cols_str, table_widths = self.fold_columns(cols, rows_widths)
         table_width = sum(table_widths) + len(cols) + 1 + len(cols) * self.margin
         if self.check_display(table_width):
-            return self.create_unfolded_table(rows, cols_str, table_widths)
+            yield cols_str
+            yield from self.unfolded_lines(rows, table_widths)
+            return
         cols_map = self.folding_bool_map(rows_widths, cols_widths)
         table_widths = self.mask(table_widths, cols_map)
-        return self.create_folded_table(rows, cols, table_widths)
+        split_, table_widths = self.split_rows(rows, table_widths)
+        yield self.fold_columns(cols, table_widths)[0]
+        yield from self.folded_lines(split_, table_widths)
+
+    def write(self, rows, cols, stream=None):
+        """Write table to stream page by page, without building it as one string."""
+        stream = stream or sys.stdout
+        for frame in self.rows_to_frames(rows):
+            for line in self.iter_fold(frame, cols):
+                stream.write(line)
+                stream.write("\n")
+        stream.flush()
 
     def fold_columns(self, cols, rows_widths):
         zipped = list(
@@ -237,22 +564,20 @@ class DataPrinter:
         return top_bottom, widths
 
     def folded_printer(self, rows, table_widths):
-        added_margins = [
-            self.add_margins(chain(row), table_widths) for row in chain(rows)
-        ]
-        added_vertlines = [self.add_vertlines(row) for row in chain(added_margins)]
+        return "\n".join(self.folded_lines(rows, table_widths))
+
+    def folded_lines(self, rows, table_widths):
         horizontal = self.hzline(table_widths, margin=True)
-        ready_rows = [
-            iadd("\n".join(row), horizontal) for row in chain(added_vertlines)
-        ]
-        return "\n".join(ready_rows)
+        for row in rows:
+            vertlines = self.add_vertlines(self.add_margins(row, table_widths))
+            yield iadd("\n".join(vertlines), horizontal)
 
     def display_interactive(self, data, columns):
         """Enter: next frame.
         """
         for i, frame in enumerate(self.rows_to_frames(data)):
-            frame_str = self.fold(frame, columns)
-            print(frame_str)
+            for line in self.iter_fold(frame, columns):
+                print(line)
             ui = input(
                 f"End of page {i+1}.\nPress any key to display next page...q for quit\n"
             )
@@ -262,13 +587,19 @@ class DataPrinter:
 
     def rows_to_frames(self, rows):
         frame = []
-        for i, row in enumerate(rows):
+        for row in rows:
             frame.append(row)
-            if not (i + 1) % self.rows_pp:
+            if len(frame) == self.rows_pp:
                 yield frame
-                frame.clear()
+                frame = []
+        if frame:
+            yield frame
 
     def fold_rows(self, rows, cols_widths):
+        split_, table_widths = self.split_rows(rows, cols_widths)
+        return self.folded_printer(split_, table_widths), table_widths
+
+    def split_rows(self, rows, cols_widths):
         split_ = self._splitter(rows, cols_widths, self.column_width(len(cols_widths)))
         row_widths_ = self._widests(split_)
         table_widths = self.table_widths(row_widths_, cols_widths)
@@ -276,9 +607,9 @@ class DataPrinter:
             sum(table_widths) + len(row_widths_) * self.margin + len(row_widths_) + 1
         )
         if width_sum <= self.terminal_width:
-            return self.folded_printer(split_, table_widths), table_widths
+            return split_, table_widths
         raise ValueError(
-            "Can't display all the columns without losing readability.\nPlease choose less columns to sort by, use wider terminal or consider adding export to CSV file feature."
+            "Can't display all the columns without losing readability.\nPlease choose less columns to sort by, use wider terminal or export the data with --output csv."
         )
 
     def add_margins(self, rows, row_widths):
@@ -330,22 +661,16 @@ class DataPrinter:
         if index_col:
             return self.print_highscores(data)
         cols = self.prepare_cols(columns)
-        if len(data) > max(self.rows_pp, 20):
-            return self.display_interactive(data, cols)
-        return self.fold(data, cols)
+        rows = iter(data)
+        limit = max(self.rows_pp, 20)
+        head = list(islice(rows, limit + 1))
+        if len(head) <= limit:
+            return self.fold(head, cols)
+        if self.interactive:
+            return self.display_interactive(chain(head, rows), cols)
+        self.write(chain(head, rows), cols)
+        return "End of pages"
 
     def print_highscores(self, data):
-        data = self._flatten(data)
         cols = ["Category", "Movie", "Value"]
-        cats = [
-            "Runtime",
-            "Box Office",
-            "Awards Won",
-            "Nominations",
-            "Oscars",
-            "IMDB Rating",
-        ]
-        data = list(map(list, data))
-        for i in range(len(data)):
-            data[i].insert(0, cats[i])
         return self.fold(data, cols)
@@ -0,0 +1,54 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        title = params.get("i", params.get("t", [""]))[0]
+        movie = self.server.movies.get(
+            title.casefold(), {"Response": "False", "Error": "Movie not found!"}
+        )
+        body = json.dumps(movie).encode()
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOMDb(ThreadingHTTPServer):
+    """Local OMDb look-alike serving given movies, counts requests and connections."""
+
+    daemon_threads = True
+
+    def __init__(self, movies):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        movies = list(movies)
+        self.movies = {movie["Title"].casefold(): movie for movie in movies}
+        self.movies.update({movie["imdbID"]: movie for movie in movies if "imdbID" in movie})
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
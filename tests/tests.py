@@ -1,14 +1,42 @@
 import os
+import sys
+import importlib.util
+import io
+import csv
 import json
+import threading
 import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+import sqlite3 as sq3
 from operator import itemgetter
-from itertools import zip_longest
+from itertools import zip_longest, islice
+from concurrent.futures import ThreadPoolExecutor
 
 from movies.db.sqlite_extensions import FUNCMAP, format_runtime
 import movies.db.dbm as dbm
+from movies.db.pool import PooledDatabaseManager
+import movies.db.migrations as migrations
 import movies.db.query as query
 import movies.requester as req
+import movies.utils as utils
+import movies.export as export
+import movies.tools as tools
+import movies.analytics as analytics
+from movies.cache import ResponseCache
+from movies.server import QueryServer
 from movies.conf import DATA_MAP
+from tests.stub import StubOMDb
+import benchmarks.startup as startup
+import benchmarks.catalog as catalog
+import benchmarks.hot_paths as hot_paths
+import benchmarks.compare as bench_compare
+
+
+def load_fixture():
+    with open("tests/movies.json") as file_:
+        return json.load(file_)
 
 
 class TestSQLiteCustomFunctions(unittest.TestCase):
@@ -264,6 +292,10 @@ class TestDatabaseManager(unittest.TestCase):
     def tearDown(self):
         os.system("rm tests/tmp.db")
 
+    def highscore(self, category):
+        data = self.db_api.select_one(query.highscores(), (1,))
+        return [row[1:] for row in data if row[0] == category]
+
     def test_updating_one_row(self):
         self.db_api.insert_one(query.update(), self.update_data[0])
         db_data = self.db_api.select_one(
@@ -416,7 +448,9 @@ class TestDatabaseManager(unittest.TestCase):
 
     def test_filter_by_movies_over_80_ratio(self):
         self.db_api.insert_many(query.update(), self.update_data)
-        data = self.db_api.select_one(query.filter_("eighty"))
+        data = self.db_api.select_one(
+            query.filter_("eighty"), data=query.filter_data("eighty")
+        )
         self.assertEqual(list(map(itemgetter(0), data)), ["Memento", "The Godfather"])
 
     def test_filter_by_language(self):
@@ -486,54 +520,1467 @@ class TestDatabaseManager(unittest.TestCase):
         self.db_api.insert_many(query.update(), self.update_data)
         self.assertEqual(
             [("The Godfather", "2h55min")],
-            self.db_api.select_one(query.highscores()[0],),
+            self.highscore("Runtime"),
         )
 
     def test_highscore_in_earnings(self):
         self.db_api.insert_many(query.update(), self.update_data,)
         self.assertEqual(
             [("Memento", "$23,844,220")],
-            self.db_api.select_one(query.highscores()[1],),
+            self.highscore("Box Office"),
         )
 
     def test_highscore_in_awards(self):
         self.db_api.insert_many(query.update(), self.update_data,)
         self.assertEqual(
             [("Memento", "56")],
-            self.db_api.select_one(query.highscores()[2],),
+            self.highscore("Awards Won"),
         )
 
     def test_highscore_in_nominations(self):
         self.db_api.insert_many(query.update(), self.update_data)
         self.assertEqual(
             [("Memento", "55")],
-            self.db_api.select_one(query.highscores()[3]),
+            self.highscore("Nominations"),
         )
 
     def test_highscore_in_oscars(self):
         self.db_api.insert_many(query.update(), self.update_data)
         self.assertEqual(
             [("The Godfather", "3")],
-            self.db_api.select_one(query.highscores()[4]),
+            self.highscore("Oscars"),
         )
 
     def test_highscore_in_imdb_rating(self):
         self.db_api.insert_many(query.update(), self.update_data)
         self.assertEqual(
             [("The Shawshank Redemption", "9.3")],
-            self.db_api.select_one(query.highscores()[5]),
+            self.highscore("IMDB Rating"),
         )
 
     def test_highscores_in_all_categories(self):
         self.db_api.insert_many(query.update(), self.update_data)
         self.assertEqual(
             [
-                [("The Godfather", "2h55min")],
-                [("Memento", "$23,844,220")],
-                [("Memento", "56")],
-                [("Memento", "55")],
-                [("The Godfather", "3")],
-                [("The Shawshank Redemption", "9.3")],
+                ("Runtime", "The Godfather", "2h55min"),
+                ("Box Office", "Memento", "$23,844,220"),
+                ("Awards Won", "Memento", "56"),
+                ("Nominations", "Memento", "55"),
+                ("Oscars", "The Godfather", "3"),
+                ("IMDB Rating", "The Shawshank Redemption", "9.3"),
             ],
-            self.db_api.select_many(query.highscores()),
+            self.db_api.select_one(query.highscores(), (1,)),
+        )
+
+
+class TestAwardColumns(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def test_award_columns_parsed_on_update(self):
+        data = self.db_api.select_one(
+            "SELECT AWARDS_WON, NOMINATIONS, OSCARS_WON, OSCARS_NOM FROM MOVIES WHERE TITLE=?",
+            ("The Godfather",),
+        )
+        self.assertEqual(data, [(24, 28, 3, 0)])
+
+    def test_award_columns_parsed_on_insert(self):
+        movie = dict(load_fixture()[1], Title="Memento 2")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        data = self.db_api.select_one(
+            "SELECT AWARDS_WON, NOMINATIONS, OSCARS_WON, OSCARS_NOM FROM MOVIES WHERE TITLE=?",
+            ("Memento 2",),
+        )
+        self.assertEqual(data, [(56, 55, 0, 2)])
+
+    def test_award_columns_backfilled(self):
+        self.db_api.con.close()
+        os.system("cp tests/test.db tests/tmp.db")
+        con = sq3.connect("tests/tmp.db")
+        con.execute("UPDATE MOVIES SET AWARDS=? WHERE TITLE=?", ("Won 3 Oscars. Another 24 wins & 28 nominations.", "Gods"))
+        con.commit()
+        con.close()
+        self.db_api = dbm.DatabaseManager(tests=True)
+        data = self.db_api.select_one(
+            "SELECT AWARDS_WON, NOMINATIONS, OSCARS_WON FROM MOVIES WHERE TITLE=?",
+            ("Gods",),
+        )
+        self.assertEqual(data, [(24, 28, 3)])
+
+    def test_filter_by_ratio_threshold(self):
+        data = self.db_api.select_one(
+            query.filter_("eighty"), data=query.filter_data("eighty", "0.6")
+        )
+        self.assertEqual(
+            list(map(itemgetter(0), data)), ["Memento", "In Bruges", "Gods", "The Godfather"]
+        )
+
+    def test_filter_by_invalid_ratio_threshold(self):
+        self.assertRaises(ValueError, lambda: query.filter_data("eighty", "most"))
+
+    def test_filter_by_oscar_nomination(self):
+        data = self.db_api.select_one(query.filter_("oscar_nom"))
+        self.assertEqual(
+            list(map(itemgetter(0), data)),
+            ["The Shawshank Redemption", "Memento", "In Bruges"],
+        )
+
+    def test_sort_by_awards(self):
+        data = self.db_api.select_one(query.sort("awards"))
+        self.assertEqual(data[:2], [("Memento", "56"), ("In Bruges", "28")])
+
+
+class TestPeopleIndex(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def filter_(self, *category):
+        values = query.filter_data(*category)
+        return self.db_api.select_one(query.filter_(category[0], len(values)), values)
+
+    def test_filter_by_director_ignores_case(self):
+        self.assertEqual(
+            self.filter_("director", "christopher NOLAN"),
+            [("Memento", "Christopher Nolan")],
+        )
+
+    def test_filter_by_writer(self):
+        self.assertEqual(
+            list(map(itemgetter(0), self.filter_("writer", "Francis Ford Coppola"))),
+            ["The Godfather"],
+        )
+
+    def test_filter_by_all_people(self):
+        data = self.filter_("people", "Al Pacino", "marlon brando", "Francis Ford Coppola")
+        self.assertEqual(list(map(itemgetter(0), data)), ["The Godfather"])
+        self.assertEqual(self.filter_("people", "Al Pacino", "Guy Pearce"), [])
+
+    def test_filter_by_person_requires_name(self):
+        self.assertRaises(ValueError, lambda: query.filter_data("actor"))
+
+    def test_filter_by_one_person_only(self):
+        self.assertRaises(ValueError, lambda: query.filter_data("actor", "Al Pacino", "Guy Pearce"))
+
+    def test_person_index_follows_updates(self):
+        movie = dict(load_fixture()[1], Director="Jonathan Nolan")
+        self.db_api.insert_one(query.update(), req.rotated_row(movie))
+        self.assertEqual(self.filter_("director", "Christopher Nolan"), [])
+        self.assertEqual(
+            self.filter_("director", "Jonathan Nolan"), [("Memento", "Jonathan Nolan")]
+        )
+
+    def test_person_filter_uses_index(self):
+        values = query.filter_data("director", "Christopher Nolan")
+        plan = self.db_api.select_one(f"EXPLAIN QUERY PLAN {query.filter_('director')}", values)
+        self.assertFalse(any(row[-1].startswith("SCAN MOVIES") for row in plan))
+
+
+class TestFacetIndex(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def titles(self, col, value):
+        data = self.db_api.select_one(query.filter_(col), query.filter_data(col, value))
+        return list(map(itemgetter(0), data))
+
+    def test_filter_by_language(self):
+        self.assertEqual(self.titles("language", "polish"), ["Gods"])
+        self.assertEqual(self.titles("language", "Italia"), [])
+
+    def test_filter_by_country(self):
+        self.assertEqual(self.titles("country", "uk"), ["In Bruges"])
+
+    def test_filter_by_genre(self):
+        self.assertEqual(
+            self.titles("genre", "Drama"),
+            ["The Shawshank Redemption", "In Bruges", "Gods", "The Godfather"],
+        )
+
+    def test_facet_index_follows_inserts(self):
+        movie = dict(load_fixture()[3], Title="Gods 2", Language="Polish, German")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(self.titles("language", "german"), ["Gods 2"])
+
+    def test_facet_filters_use_index(self):
+        for col in ["language", "country", "genre"]:
+            plan = self.db_api.select_one(
+                f"EXPLAIN QUERY PLAN {query.filter_(col)}", query.filter_data(col, "x")
+            )
+            self.assertFalse(any(row[-1].startswith("SCAN MOVIES") for row in plan))
+
+
+class TestHighscores(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def test_highscores_top_places(self):
+        data = self.db_api.select_one(query.highscores(), (2,))
+        self.assertEqual(
+            [row for row in data if row[0] == "IMDB Rating"],
+            [
+                ("IMDB Rating", "The Shawshank Redemption", "9.3"),
+                ("IMDB Rating", "The Godfather", "9.2"),
+            ],
+        )
+        self.assertEqual(
+            [row for row in data if row[0] == "Oscars"],
+            [("Oscars", "The Godfather", "3")],
+        )
+
+    def test_highscores_ties(self):
+        movie = dict(load_fixture()[4], Title="The Godfather Part II")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        data = self.db_api.select_one(query.highscores(), (1,))
+        self.assertEqual(
+            [row[1] for row in data if row[0] == "Runtime"],
+            ["The Godfather", "The Godfather Part II"],
+        )
+
+    def test_highscores_use_indexes(self):
+        plan = self.db_api.select_one(f"EXPLAIN QUERY PLAN {query.highscores()}", (1,))
+        self.assertFalse([row for row in plan if row[-1].startswith("SCAN MOVIES")])
+        searched = " ".join(row[-1] for row in plan if row[-1].startswith("SEARCH MOVIES"))
+        names = {key: name for name, key in query.sort_indexes().items()}
+        for _, key in query.HIGHSCORES.values():
+            self.assertIn(names[key], searched)
+
+    def test_sorts_use_indexes(self):
+        for col in query.SORT:
+            plan = " ".join(row[-1] for row in self.db_api.select_one(f"EXPLAIN QUERY PLAN {query.sort(col)}"))
+            self.assertIn("USING", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_no_duplicate_indexes(self):
+        indexes = self.db_api.select_one(
+            "SELECT NAME FROM sqlite_master WHERE TYPE='index' AND TBL_NAME='MOVIES' AND SQL IS NOT NULL"
+        )
+        names = {name for name, in indexes}
+        self.assertFalse(names & set(migrations.RETIRED_INDEXES))
+        self.assertEqual(len(names), len(query.sort_indexes()) + 3)
+        plan = self.db_api.select_one("EXPLAIN QUERY PLAN SELECT ID FROM MOVIES WHERE TITLE=?", ("Heat",))
+        self.assertIn("movies_sort_title", plan[0][-1])
+
+    def test_functions_deterministic(self):
+        self.assertRaises(
+            sq3.OperationalError,
+            self.db_api.con.execute,
+            "CREATE INDEX random_key ON MOVIES (random())",
+        )
+        self.db_api.con.execute("CREATE INDEX runtime_text ON MOVIES (tform(RUNTIME))")
+
+    def test_highscores_new_category_indexed(self):
+        categories = dict(query.HIGHSCORES)
+        try:
+            query.HIGHSCORES["Votes"] = ("int_to_comas", "IMDB_VOTES")
+            data = self.db_api.select_one(query.highscores(), (1,))
+            plan = self.db_api.select_one(
+                f"EXPLAIN QUERY PLAN {query.highscores()}", (1,)
+            )
+        finally:
+            query.HIGHSCORES.clear()
+            query.HIGHSCORES.update(categories)
+        self.assertIn(("Votes", "The Shawshank Redemption", "2,215,887"), data)
+        self.assertFalse([row for row in plan if row[-1].startswith("SCAN MOVIES")])
+
+
+class TestPooledRequester(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubOMDb(load_fixture())
+        self.site = self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_request_many_reuses_connections(self):
+        titles = [movie["Title"] for movie in load_fixture()] * 4
+        requester = req.Requester("key", workers=4, pool_size=2, site=self.site)
+        data = requester.request_many(titles)
+        requester.close()
+        self.assertEqual(sorted(movie["Title"] for movie in data), sorted(titles))
+        self.assertEqual(self.stub.requests, len(set(titles)))
+        self.assertLessEqual(self.stub.connections, 2)
+
+    def test_request_timeout(self):
+        requester = req.Requester("key", timeout=0.001, site="http://10.255.255.1")
+        self.assertRaises(ValueError, lambda: requester.request("Memento"))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubOMDb(load_fixture())
+        self.site = self.stub.start()
+        self.cache_fp = "tests/tmp_cache.sqlite"
+
+    def tearDown(self):
+        self.stub.stop()
+        os.remove(self.cache_fp)
+
+    def requester(self, ttl=60, negative_ttl=60, size=100):
+        cache = ResponseCache(self.cache_fp, ttl, negative_ttl, size)
+        return req.Requester("key", site=self.site, cache=cache)
+
+    def test_cached_responses_skip_network(self):
+        titles = ["Memento", "Gods"]
+        self.requester().request_many(titles)
+        data = self.requester().request_many(titles)
+        self.assertEqual([movie["Title"] for movie in data], titles)
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_cache_key_is_normalized(self):
+        requester = self.requester()
+        requester.request("The Godfather")
+        self.assertEqual(requester.request("  the  GODFATHER")["Title"], "The Godfather")
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_duplicate_titles_merged(self):
+        data = self.requester().request_many(["Memento", "memento", "Memento "])
+        self.assertEqual(len(data), 3)
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_negative_entries(self):
+        requester = self.requester()
+        for _ in range(2):
+            self.assertRaises(ValueError, lambda: requester.request("Not a title!"))
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_only_not_found_cached(self):
+        cache = ResponseCache(self.cache_fp, 60, 60, 100)
+        cache.store({
+            "gods": {"Response": "False", "Error": "Movie not found!"},
+            "heat": {"Response": "False", "Error": "Request limit reached!"},
+            "memento": {"Response": "False", "Error": "Invalid API key!"},
+        })
+        self.assertEqual(set(cache.get_many(["gods", "heat", "memento"])), {"gods"})
+
+    def test_expired_entries_downloaded_again(self):
+        self.requester(ttl=-1).request("Memento")
+        self.requester().request("Memento")
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_least_recently_used_evicted(self):
+        requester = self.requester(size=2)
+        for title in ["Memento", "Gods", "Memento", "In Bruges"]:
+            requester.request(title)
+        self.assertEqual(
+            set(requester.cache.get_many(["memento", "gods", "in bruges"])),
+            {"memento", "in bruges"},
+        )
+
+
+def offline_commander(db_api, site):
+    commander = utils.Commander(query_cache_fp=None)
+    commander._db_api = db_api
+    commander._downloader = req.Downloader.__new__(req.Downloader)
+    commander._downloader.req = req.Requester("key", site=site)
+    return commander
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.stub = StubOMDb(load_fixture())
+        self.site = self.stub.start()
+        self.commander = offline_commander(self.db_api, self.site)
+
+    def tearDown(self):
+        self.stub.stop()
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def test_refresh_downloads_stale_rows_only(self):
+        summary = self.commander.refresh()
+        self.assertTrue(summary.startswith("Refreshed 5 movies: 5 updated, 0 unchanged."))
+        self.assertEqual(self.stub.requests, 100)
+        self.assertEqual(
+            self.commander.refresh(), "Refreshed 0 movies: 0 updated, 0 unchanged."
+        )
+        self.assertEqual(self.stub.requests, 100)
+
+    def test_refresh_skips_unchanged_rows(self):
+        self.commander.refresh()
+        self.db_api.con.execute("UPDATE MOVIES SET AWARDS='N/A' WHERE TITLE='Gods'")
+        self.db_api.con.commit()
+        summary = self.commander.refresh(max_age=0, missing_age=0)
+        self.assertTrue(summary.startswith("Refreshed 5 movies: 0 updated, 5 unchanged."))
+        self.assertEqual(
+            self.db_api.select_one("SELECT AWARDS FROM MOVIES WHERE TITLE='Gods'"),
+            [("N/A",)],
+        )
+
+    def test_refresh_recent_rows(self):
+        self.commander.refresh()
+        self.commander.refresh(max_age=0)
+        self.assertEqual(self.stub.requests, 200)
+
+    def test_refresh_rows_missing_data(self):
+        self.commander.refresh()
+        self.db_api.con.execute("UPDATE MOVIES SET LAST_FETCHED=LAST_FETCHED-7200")
+        self.db_api.con.commit()
+        summary = self.commander.refresh(missing_age=3600)
+        self.assertTrue(summary.startswith("Refreshed 3 movies: 0 updated, 3 unchanged."))
+
+    def test_failed_connections_retried(self):
+        stale = "SELECT COUNT(*) FROM MOVIES WHERE LAST_FETCHED IS NULL"
+        self.commander._downloader.req = req.Requester("key", site="http://127.0.0.1:9")
+        self.commander.refresh()
+        self.assertEqual(self.db_api.select_one(stale), [(100,)])
+        self.commander._downloader.req = req.Requester("key", site=self.site)
+        self.commander.refresh()
+        self.assertEqual(self.db_api.select_one(stale), [(0,)])
+
+    def test_failed_population_not_populated(self):
+        self.commander._downloader.req = req.Requester("key", site="http://127.0.0.1:9")
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as err, mock.patch(
+            "sys.stdout", new_callable=io.StringIO
+        ) as out:
+            self.commander.populate_db()
+        self.assertIn("t=Gods&apikey", err.getvalue())
+        self.assertEqual(out.getvalue(), "")
+        self.assertFalse(self.commander.populated())
+        self.commander._downloader.req = req.Requester("key", site=self.site)
+        with mock.patch("sys.stderr", new_callable=io.StringIO):
+            self.commander.populate_db()
+        self.assertTrue(self.commander.populated())
+        self.assertEqual(self.stub.requests, 100)
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+
+    def tearDown(self):
+        os.system("rm tests/tmp.db")
+
+    def test_migrations_recorded(self):
+        db_api = dbm.DatabaseManager(tests=True)
+        self.assertEqual(db_api.meta("schema_version"), len(migrations.MIGRATIONS))
+        self.assertEqual(db_api.meta("populated"), 0)
+        db_api.con.close()
+
+    def test_populated_file_detected(self):
+        con = sq3.connect("tests/tmp.db")
+        con.execute("UPDATE MOVIES SET YEAR=1994 WHERE ID=0")
+        con.commit()
+        con.close()
+        db_api = dbm.DatabaseManager(tests=True)
+        self.assertEqual(db_api.meta("populated"), 1)
+        db_api.con.close()
+
+    def test_new_migration_applied_once(self):
+        dbm.DatabaseManager(tests=True).con.close()
+        calls = []
+        migrations.MIGRATIONS.append(calls.append)
+        try:
+            dbm.DatabaseManager(tests=True).con.close()
+            db_api = dbm.DatabaseManager(tests=True)
+        finally:
+            migrations.MIGRATIONS.pop()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(db_api.meta("schema_version"), len(migrations.MIGRATIONS) + 1)
+        db_api.con.close()
+
+    def test_empty_file_gets_schema(self):
+        open("tests/tmp.db", "w").close()
+        db_api = dbm.DatabaseManager(tests=True)
+        self.assertEqual(db_api.get_titles(), [])
+        db_api.con.close()
+
+    def test_missing_file(self):
+        os.system("rm tests/tmp.db")
+        self.assertRaises(ValueError, lambda: dbm.DatabaseManager(tests=True))
+        os.system("touch tests/tmp.db")
+
+    def test_populated_db_not_downloaded(self):
+        db_api = dbm.DatabaseManager(tests=True)
+        db_api.set_meta("populated", 1)
+        commander = offline_commander(db_api, "http://127.0.0.1:9")
+        commander.populate_db()
+        self.assertEqual(db_api.select_one("SELECT COUNT(*) FROM MOVIES WHERE LAST_FETCHED IS NOT NULL"), [(0,)])
+        db_api.con.close()
+
+
+class TestStartup(unittest.TestCase):
+    def test_no_network_modules_imported(self):
+        self.assertEqual(startup.heavy_imports(), [])
+
+    def test_commander_built_lazily(self):
+        commander = utils.Commander(query_cache_fp=None)
+        self.assertIsNone(commander._db_api)
+        self.assertIsNone(commander._printer)
+        self.assertIsNone(commander._downloader)
+
+    def test_credentials_check_cached(self):
+        cache = ResponseCache("tests/tmp_cache.sqlite", 60, 60, 10)
+        cache.put(req.Credentials.cache_key("cachedkey"), True)
+        try:
+            creds = req.Credentials(key="cachedkey", cache=cache)
+            self.assertEqual(creds.apikey(), "cachedkey")
+            cache.put(req.Credentials.cache_key("cachedkey"), True, ttl=-1)
+            self.assertRaises(
+                ValueError, lambda: req.Credentials(key="cachedkey", cache=cache)
+            )
+        finally:
+            cache.close()
+            os.remove("tests/tmp_cache.sqlite")
+
+
+class TestStreamingSelect(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+
+    def test_iter_select_matches_select_one(self):
+        rows = self.db_api.iter_select(query.sort("year", "title"), batch=7)
+        self.assertEqual(list(rows), self.db_api.select_one(query.sort("year", "title")))
+
+    def test_iter_select_with_data(self):
+        values = query.filter_data("language", "english")
+        rows = self.db_api.iter_select(query.filter_("language"), values, batch=1)
+        self.assertEqual(len(list(rows)), 4)
+
+    def test_iter_select_raises_before_iterating(self):
+        self.assertRaises(ValueError, lambda: self.db_api.iter_select("SELECT * FROM NOPE"))
+
+    def test_iter_select_is_lazy(self):
+        rows = self.db_api.iter_select(query.sort("title"), batch=10)
+        self.assertEqual(len(list(islice(rows, 3))), 3)
+        rows.close()
+        self.assertEqual(len(self.db_api.select_one(query.sort("title"))), 100)
+
+
+class TestDataPrinterFrames(unittest.TestCase):
+    def setUp(self):
+        self.printer = utils.DataPrinter(rows_pp=3)
+
+    def test_frames_keep_last_partial_frame(self):
+        frames = list(self.printer.rows_to_frames(iter(range(7))))
+        self.assertEqual(frames, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_display_short_iterator(self):
+        rows = iter([("Memento", "2000"), ("Gods", "2014")])
+        table = self.printer.display(rows, ["year"])
+        self.assertIn("Memento", table)
+        self.assertIn("Gods", table)
+
+    def test_fold_matches_streamed_lines(self):
+        rows = [("The Godfather", "Marlon Brando, Al Pacino"), ("Memento", "Guy Pearce")]
+        cols = ["title", "actors"]
+        self.assertEqual(
+            self.printer.fold(rows, cols), "\n".join(self.printer.iter_fold(rows, cols))
+        )
+
+    def test_write_streams_every_frame(self):
+        printer = utils.DataPrinter(rows_pp=2, interactive=False)
+        rows = iter([("Movie %d" % i, str(2000 + i)) for i in range(5)])
+        stream = io.StringIO()
+        printer.write(rows, printer.prepare_cols(["year"]), stream)
+        output = stream.getvalue()
+        self.assertEqual(output.count("Title"), 3)
+        for i in range(5):
+            self.assertIn("Movie %d" % i, output)
+
+    def test_display_writes_long_results_when_not_interactive(self):
+        printer = utils.DataPrinter(rows_pp=2, interactive=False)
+        rows = iter([("Movie %d" % i, str(2000 + i)) for i in range(25)])
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertEqual(printer.display(rows, ["year"]), "End of pages")
+        self.assertIn("Movie 24", out.getvalue())
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.out_fp = "tests/tmp_export"
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+        if os.path.exists(self.out_fp):
+            os.remove(self.out_fp)
+
+    def commander(self, output):
+        cmd = utils.Commander(output=output, output_fp=self.out_fp, query_cache_fp=None)
+        cmd._db_api = self.db_api
+        return cmd
+
+    def test_header_puts_title_first(self):
+        self.assertEqual(export.header(["year", "title", "runtime"]), ["title", "year", "runtime"])
+
+    def test_csv_sort_matches_query(self):
+        msg = self.commander("csv").sort_by("year", "runtime")
+        with open(self.out_fp, newline="") as f:
+            rows = list(csv.reader(f))
+        expected = self.db_api.select_one(query.sort("year", "runtime", raw=True))
+        self.assertEqual(msg, f"Exported {len(expected)} rows.")
+        self.assertEqual(rows[0], ["title", "year", "runtime"])
+        self.assertEqual(
+            [tuple(row) for row in rows[1:]],
+            [tuple("" if value is None else str(value) for value in row) for row in expected],
+        )
+
+    def test_jsonl_raw_values(self):
+        self.commander("jsonl").sort_by("boxoffice", "runtime", "rating")
+        with open(self.out_fp) as f:
+            records = {record["title"]: record for record in map(json.loads, f)}
+        self.assertEqual(
+            records["In Bruges"], {"title": "In Bruges", "boxoffice": 7550836, "runtime": 107, "rating": 7.9}
+        )
+        self.assertEqual(records["Heat"], {"title": "Heat", "boxoffice": None, "runtime": None, "rating": None})
+
+    def test_tsv_filter(self):
+        self.commander("tsv").filter_by(["director", "Christopher Nolan"])
+        with open(self.out_fp) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "title\tdirector")
+        self.assertIn("Memento\tChristopher Nolan", lines)
+
+    def test_jsonl_highscores(self):
+        self.commander("jsonl").highscores()
+        with open(self.out_fp) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(set(records[0]), {"category", "title", "value"})
+        self.assertEqual(len({record["category"] for record in records}), len(query.HIGHSCORES))
+
+    def test_unknown_format(self):
+        self.assertIn("Unknown output format", self.commander("xml").sort_by("year"))
+
+    def test_stdout_named_on_write_error(self):
+        cmd = self.commander("csv")
+        cmd.output_fp = None
+        with mock.patch.object(export, "export", side_effect=BrokenPipeError(32, "Broken pipe")):
+            self.assertIn("Can't write to stdout: Broken pipe.", cmd.sort_by("year"))
+        self.assertFalse(os.path.exists(self.out_fp))
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.cmd = utils.Commander(query_cache_fp=None)
+        self.cmd._db_api = self.db_api
+        self.records = []
+        for i, movie in enumerate(load_fixture()):
+            self.records.append(dict(movie, Title=f"{movie['Title']} {i}"))
+        self.import_fp = "tests/tmp_import.jsonl"
+        self.write_records(self.import_fp, self.records)
+
+    def tearDown(self):
+        self.db_api.con.close()
+        os.system("rm tests/tmp.db")
+        for fp in ("tests/tmp_import.jsonl", "tests/tmp_import.json"):
+            if os.path.exists(fp):
+                os.remove(fp)
+
+    def write_records(self, filepath, records):
+        with open(filepath, "w") as f:
+            if filepath.endswith(".jsonl"):
+                f.writelines(json.dumps(record) + "\n" for record in records)
+            else:
+                json.dump(records, f)
+
+    def test_import_jsonl(self):
+        msg = self.cmd.import_movies(self.import_fp)
+        self.assertEqual(
+            msg, "Imported 5 movies, skipped 0 already in database and 0 invalid records."
+        )
+        self.assertEqual(len(self.db_api.get_titles()), 105)
+        fetched = self.db_api.select_one(
+            "SELECT LAST_FETCHED, CONTENT_HASH FROM MOVIES WHERE TITLE=?", ("Memento 1",)
+        )
+        self.assertTrue(all(fetched[0]))
+        self.assertTrue(self.cmd.populated())
+
+    def test_import_indexes_people_and_awards(self):
+        self.cmd.import_movies(self.import_fp)
+        data = self.db_api.select_one(
+            query.filter_("director"), query.filter_data("director", "frank darabont")
+        )
+        self.assertIn("The Shawshank Redemption 0", [row[0] for row in data])
+        awards = self.db_api.select_one(
+            "SELECT AWARDS_WON, NOMINATIONS FROM MOVIES WHERE TITLE=?",
+            ("The Shawshank Redemption 0",),
+        )
+        self.assertEqual(awards, [(21, 43)])
+
+    def test_import_restores_settings(self):
+        indexes = self.db_api.select_one(query.QUERY["movies_indexes"])
+        sync = self.db_api.select_one("PRAGMA synchronous;")
+        self.cmd.import_movies(self.import_fp)
+        self.assertEqual(self.db_api.select_one(query.QUERY["movies_indexes"]), indexes)
+        self.assertEqual(self.db_api.select_one("PRAGMA synchronous;"), sync)
+
+    def test_import_rebuilds_full_text(self):
+        triggers = self.db_api.select_one(query.QUERY["fts_triggers"])
+        self.assertEqual(len(triggers), 6)
+        self.cmd.import_movies(self.import_fp)
+        self.assertEqual(self.db_api.select_one(query.QUERY["fts_triggers"]), triggers)
+        self.assertIsNone(self.db_api.meta("dropped_triggers"))
+        for table in migrations.FTS_TABLES:
+            self.db_api.select_one(f"INSERT INTO {table} ({table}) VALUES ('integrity-check');")
+        self.assertEqual(self.db_api.find_title("memento 11")[1], "Memento 1")
+        found = self.db_api.select_one(query.search(raw=True), ("memento", 10))
+        self.assertIn("Memento 1", [row[0] for row in found])
+
+    def test_crashed_import_indexes_restored(self):
+        indexes = self.db_api.select_one(query.QUERY["movies_indexes"])
+        migrations.drop_indexes(self.db_api.con, indexes)
+        self.db_api.con.close()
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.assertEqual(self.db_api.select_one(query.QUERY["movies_indexes"]), indexes)
+        self.assertIsNone(self.db_api.meta("dropped_indexes"))
+
+    def test_crashed_import_triggers_restored(self):
+        triggers = self.db_api.select_one(query.QUERY["fts_triggers"])
+        migrations.drop_triggers(self.db_api.con, triggers)
+        self.db_api.con.close()
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.assertEqual(self.db_api.select_one(query.QUERY["fts_triggers"]), triggers)
+        self.assertIsNone(self.db_api.meta("dropped_triggers"))
+
+    def test_import_skips_duplicates_and_invalid(self):
+        records = self.records + load_fixture()[:2] + [{"Response": "False"}, "junk"]
+        self.write_records("tests/tmp_import.json", records + self.records[:1])
+        msg = self.cmd.import_movies("tests/tmp_import.json")
+        self.assertEqual(
+            msg, "Imported 5 movies, skipped 3 already in database and 2 invalid records."
+        )
+
+    def test_import_malformed_lines(self):
+        with open(self.import_fp, "a") as f:
+            f.write('{"Title": "Cut short\n')
+            f.write(json.dumps(dict(self.records[0], Title="Memento II")) + "\n")
+        msg = self.cmd.import_movies(self.import_fp)
+        self.assertEqual(
+            msg, "Imported 6 movies, skipped 0 already in database and 1 invalid records."
+        )
+
+    def test_import_missing_numbers(self):
+        records = [dict(self.records[0], imdbRating="N/A"), dict(self.records[1], Year=2000)]
+        self.write_records(self.import_fp, records + self.records[2:])
+        msg = self.cmd.import_movies(self.import_fp)
+        self.assertEqual(
+            msg, "Imported 4 movies, skipped 0 already in database and 1 invalid records."
+        )
+        self.assertEqual(
+            self.db_api.select_one(
+                "SELECT IMDb_Rating, YEAR FROM MOVIES WHERE TITLE=?", (self.records[0]["Title"],)
+            ),
+            [(None, 1994)],
+        )
+
+    def test_import_small_batches(self):
+        rows = self.db_api.bulk_insert(
+            query.insert(), req.rows(self.records), batch=2
+        )
+        self.assertEqual(rows, 5)
+        self.assertEqual(len(self.db_api.get_titles()), 105)
+
+    def test_import_missing_file(self):
+        msg = self.cmd.import_movies("tests/nope.jsonl")
+        self.assertEqual(msg, "Can't read tests/nope.jsonl: No such file or directory.")
+
+
+class TestConnectionProfiles(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.reader = dbm.DatabaseManager(tests=True, readonly=True)
+        self.writer = dbm.DatabaseManager(tests=True)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        os.system("rm tests/tmp.db")
+
+    def pragma(self, db_api, name):
+        return db_api.select_one(f"PRAGMA {name};")[0][0]
+
+    def test_writer_uses_wal(self):
+        self.assertEqual(self.pragma(self.writer, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(self.writer, "busy_timeout"), 30000)
+
+    def test_readonly_upgrades_and_queries(self):
+        self.assertEqual(migrations.schema_version(self.reader.con), len(migrations.MIGRATIONS))
+        self.assertEqual(self.pragma(self.reader, "query_only"), 1)
+        self.assertEqual(len(self.reader.select_one(query.sort("year"))), 100)
+
+    def test_readonly_refuses_writes(self):
+        rows = req.rows(load_fixture()[:1])
+        self.assertRaises(ValueError, self.reader.insert_many, query.insert(), rows)
+
+    def test_failed_write_rolled_back(self):
+        rows = [("Failed Write",), ("Failed", "Write")]
+        sql = "INSERT INTO MOVIES (TITLE, TITLE_KEY) VALUES (?, name_key(?1));"
+        self.assertRaises(ValueError, self.writer.insert_many, sql, rows)
+        self.assertFalse(self.writer.con.in_transaction)
+        movies = [dict(movie, Title=movie["Title"] + " II") for movie in load_fixture()]
+        self.assertEqual(self.writer.bulk_insert(query.insert(), req.rows(movies)), 5)
+        self.assertEqual(len(self.writer.get_titles()), 105)
+
+    def test_reader_not_blocked_by_writer(self):
+        rows = self.reader.iter_select(query.sort("title"), batch=10)
+        first = list(islice(rows, 20))
+        movies = [dict(movie, Title=movie["Title"] + " II") for movie in load_fixture()]
+        self.writer.insert_many(query.insert(), req.rows(movies))
+        self.assertEqual(len(first) + len(list(rows)), 100)
+        self.assertEqual(len(self.reader.select_one(query.sort("title"))), 105)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = PooledDatabaseManager(tests=True)
+        self.stub = StubOMDb(
+            [dict(movie, Title=movie["Title"] + " II") for movie in load_fixture()]
+        )
+        self.site = self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def test_threads_get_own_readers(self):
+        cons = {}
+
+        def read(i):
+            cons[i] = self.db_api.con
+            return len(self.db_api.select_one(query.sort("year")))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            counts = list(executor.map(read, range(4)))
+        self.assertEqual(counts, [100] * 4)
+        self.assertEqual(len({id(con) for con in cons.values()}), len(self.db_api._readers))
+        self.assertEqual(self.db_api.select_one("SELECT _str(1)"), [("1",)])
+
+    def test_opens_given_file(self):
+        os.system("cp tests/test.db tests/tmp_pool.db")
+        db_api = PooledDatabaseManager(db_fp="tests/tmp_pool.db")
+        try:
+            with db_api.writer() as con:
+                con.execute("DELETE FROM MOVIES")
+            self.assertEqual(db_api.select_one("SELECT COUNT(*) FROM MOVIES"), [(0,)])
+            self.assertEqual(len(self.db_api.select_one(query.sort("year"))), 100)
+        finally:
+            db_api.close()
+            os.system("rm -f tests/tmp_pool.db*")
+
+    def test_downloads_written_from_worker_threads(self):
+        titles = [movie["Title"] + " II" for movie in load_fixture()]
+        writers = set()
+
+        def write(title, row):
+            writers.add(threading.get_ident())
+            self.db_api.insert_one(query.insert(), row)
+
+        downloader = req.Downloader.__new__(req.Downloader)
+        downloader.req = req.Requester("key", workers=4, site=self.site)
+        downloader.download_many(titles, process=True, callback=write)
+        downloader.req.close()
+        self.assertNotIn(threading.get_ident(), writers)
+        self.assertEqual(len(self.db_api.get_titles()), 105)
+        data = self.db_api.select_one(
+            query.filter_("director"), query.filter_data("director", "Christopher Nolan")
+        )
+        self.assertIn("Memento II", [row[0] for row in data])
+
+    def test_failed_write_is_rolled_back(self):
+        self.assertRaises(
+            ValueError, self.db_api.insert_one, "INSERT INTO NOPE VALUES (?)", (1,)
+        )
+        self.db_api.set_meta("key", "value")
+        self.assertEqual(self.db_api.meta("key"), "value")
+
+
+class TestQueryServer(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = PooledDatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.stub = StubOMDb(
+            [dict(movie, Title=movie["Title"] + " II") for movie in load_fixture()]
+        )
+        commander = offline_commander(self.db_api, self.stub.start())
+        commander.output = "records"
+        self.server = QueryServer(commander, port=0)
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.stub.stop()
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def call(self, path, method="GET"):
+        request = urllib.request.Request(self.server.url + path, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as err:
+            return err.code, json.load(err)
+
+    def test_sort_by(self):
+        status, data = self.call("/sort_by?by=year&by=runtime")
+        self.assertEqual(status, 200)
+        expected = self.db_api.select_one(query.sort("year", "runtime"))
+        self.assertEqual([tuple(row.values()) for row in data["rows"]], expected)
+        self.assertEqual(list(data["rows"][0]), ["title", "year", "runtime"])
+
+    def test_filter_by_and_compare(self):
+        status, data = self.call("/filter_by?by=director&value=Christopher+Nolan")
+        self.assertEqual(status, 200)
+        self.assertIn({"title": "Memento", "director": "Christopher Nolan"}, data["rows"])
+        status, data = self.call("/compare?by=runtime&movie=Memento&movie=Gods")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data["rows"]), 1)
+
+    def test_highscores(self):
+        status, data = self.call("/highscores?top=2")
+        self.assertEqual(status, 200)
+        self.assertEqual(set(data["rows"][0]), {"category", "title", "value"})
+
+    def test_search(self):
+        status, data = self.call("/search?q=nolan")
+        self.assertEqual(status, 200)
+        self.assertEqual([row["title"] for row in data["rows"]], ["Memento"])
+
+    def test_errors(self):
+        self.assertEqual(self.call("/sort_by?by=nope")[0], 400)
+        self.assertEqual(self.call("/highscores?top=x")[0], 400)
+        self.assertEqual(self.call("/nope")[0], 404)
+        self.assertEqual(self.call("/add?title=Memento")[0], 404)
+
+    def test_missing_parameters(self):
+        for path in ("/sort_by", "/filter_by", "/filter_by?value=Nolan"):
+            self.assertEqual(self.call(path), (400, {"error": "Provide the by parameter."}))
+
+    def test_database_error(self):
+        error = sq3.OperationalError("disk I/O error")
+        with mock.patch.object(self.server.commander, "highscores", side_effect=error):
+            status, data = self.call("/highscores")
+        self.assertEqual((status, data), (500, {"error": "Database error: disk I/O error."}))
+
+    def test_parallel_queries(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.call, ["/sort_by?by=year"] * 32))
+        self.assertEqual({status for status, _ in results}, {200})
+        self.assertEqual({len(data["rows"]) for _, data in results}, {100})
+
+    def test_add_movie(self):
+        status, data = self.call("/add?title=Memento+II", method="POST")
+        self.assertEqual((status, data), (200, {"message": "Movie added."}))
+        status, data = self.call("/add?title=Memento+II", method="POST")
+        self.assertEqual(status, 400)
+        self.assertIn("Memento II", self.db_api.get_titles())
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.cache_fp = "tests/tmp_queries.sqlite"
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+        os.remove(self.cache_fp)
+
+    def commander(self):
+        cmd = utils.Commander(output="records", query_cache_fp=self.cache_fp)
+        cmd._db_api = self.db_api
+        return cmd
+
+    def test_repeated_query_skips_database(self):
+        first = self.commander().highscores(3)
+        with mock.patch.object(self.db_api, "iter_select", side_effect=AssertionError):
+            self.assertEqual(self.commander().highscores(3), first)
+            self.assertEqual(self.commander().highscores(3), first)
+
+    def test_write_invalidates(self):
+        cmd = self.commander()
+        before = cmd.filter_by(["director", "Christopher Nolan"])
+        version = self.db_api.data_version()
+        movie = dict(load_fixture()[1], Title="Memento II")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertNotEqual(self.db_api.data_version(), version)
+        after = cmd.filter_by(["director", "Christopher Nolan"])
+        self.assertEqual(len(after), len(before) + 1)
+
+    def test_partially_read_results_not_stored(self):
+        cmd = self.commander()
+        rows = cmd._select(query.sort("year"))
+        next(rows)
+        rows.close()
+        key = cmd.results.key(self.db_api.data_version(), query.sort("year"))
+        self.assertIsNone(cmd.results.rows(key))
+
+    def test_large_results_not_stored(self):
+        cmd = self.commander()
+        cmd.results.max_rows = 10
+        self.assertEqual(len(cmd.sort_by("year")), 100)
+        key = cmd.results.key(self.db_api.data_version(), query.sort("year"))
+        self.assertIsNone(cmd.results.rows(key))
+
+
+class TestTitleKey(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def count(self):
+        return self.db_api.select_one("SELECT COUNT(*) FROM MOVIES")[0][0]
+
+    def test_duplicates_in_one_query(self):
+        titles = ["MEMENTO", "Memento II", "Heat 2", "memento ii", "Gods"]
+        self.assertEqual(self.db_api.duplicates(titles), ["MEMENTO", "memento ii", "Gods"])
+
+    def test_insert_updates_movie_with_same_title(self):
+        movie = dict(load_fixture()[1], Title="MEMENTO", Year="2001")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(self.count(), 100)
+        data = self.db_api.select_one("SELECT TITLE, YEAR FROM MOVIES WHERE TITLE_KEY='memento'")
+        self.assertEqual(data, [("Memento", 2001)])
+
+    def test_update_inserts_missing_movie(self):
+        movie = dict(load_fixture()[1], Title="Memento II")
+        self.db_api.insert_many(query.update(), req.rotated_rows([movie]))
+        self.assertEqual(self.count(), 101)
+
+    def test_check_reports_whole_batch(self):
+        movies = [dict(movie, Title=movie["Title"].upper()) for movie in load_fixture()[:2]]
+        movies.append(dict(load_fixture()[2], Title="In Bruges II"))
+        with self.assertRaises(ValueError) as err:
+            self.db_api.insert_many(query.insert(), req.rows(movies), check=True)
+        self.assertEqual(
+            err.exception.args[0],
+            "Error: Movies in DB: THE SHAWSHANK REDEMPTION, MEMENTO.",
+        )
+        self.assertEqual(self.count(), 100)
+
+    def test_has_title_uses_index(self):
+        plan = self.db_api.select_one("EXPLAIN QUERY PLAN " + query.QUERY["has_title"], ("Gods",))
+        self.assertIn("movies_title_key", " ".join(row[-1] for row in plan))
+        self.assertRaises(ValueError, self.db_api.has_title, "gods", True)
+
+    def test_migration_merges_case_duplicates(self):
+        self.db_api.close()
+        os.system("cp tests/test.db tests/tmp.db")
+        con = sq3.connect("tests/tmp.db")
+        with con:
+            con.executemany(
+                "INSERT INTO MOVIES (TITLE, YEAR, DIRECTOR, RUNTIME, AWARDS) VALUES (?, ?, ?, ?, ?)",
+                [
+                    ("HEAT", 1995, "Michael Mann", None, "N/A"),
+                    ("heat", None, None, "170 min", "Nominated for 1 Oscar."),
+                    ("MEMENTO", None, None, None, None),
+                    (None, 2000, None, None, None),
+                    (None, 2001, None, None, None),
+                ],
+            )
+        con.close()
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as err:
+            self.db_api = dbm.DatabaseManager(tests=True)
+        self.assertIn("Merged 3 movies", err.getvalue())
+        self.assertEqual(
+            self.db_api.select_one(
+                "SELECT TITLE, YEAR, DIRECTOR, RUNTIME, OSCARS_NOM FROM MOVIES WHERE TITLE_KEY='heat'"
+            ),
+            [("HEAT", 1995, "Michael Mann", "170 min", 1)],
+        )
+        self.assertEqual(self.db_api.select_one("SELECT TITLE FROM MOVIES WHERE TITLE_KEY='memento'"), [("Memento",)])
+        self.assertEqual(self.db_api.select_one("SELECT COUNT(*) FROM MOVIES WHERE TITLE IS NULL"), [(2,)])
+        self.assertIsNone(tools.name_key(None))
+
+
+class TestBatchAdd(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        movies = load_fixture()
+        movies.append(dict(movies[1], Title="Memento II", imdbID="tt9999999"))
+        movies.append(dict(movies[2], Title="In Bruges II", imdbID="tt9999998"))
+        movies.append(dict(movies[3], Title="Gods II", imdbID="tt9999997", imdbRating="N/A"))
+        self.stub = StubOMDb(movies)
+        self.commander = offline_commander(self.db_api, self.stub.start())
+        self.titles_fp = "tests/tmp_titles.txt"
+
+    def tearDown(self):
+        self.stub.stop()
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+        if os.path.exists(self.titles_fp):
+            os.remove(self.titles_fp)
+
+    def test_add_many_reports_every_title(self):
+        summary = self.commander.add_movies(
+            ["memento ii", "tt9999998", "Memento", "Nope", "Memento II"]
+        )
+        self.assertEqual(
+            summary.splitlines(),
+            [
+                "memento ii: added as Memento II.",
+                "tt9999998: added as In Bruges II.",
+                "Memento: already in database.",
+                "Nope: Download of Nope failed to: Movie not found!",
+                "Memento II: same movie as memento ii.",
+                "Added 2 of 5 movies.",
+            ],
+        )
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(len(self.db_api.get_titles()), 102)
+
+    def test_add_many_same_movie(self):
+        summary = self.commander.add_movies(["Memento II", "Memento II", "tt9999999", "MEMENTO II"])
+        self.assertEqual(
+            summary.splitlines(),
+            [
+                "Memento II: added.",
+                "tt9999999: same movie as Memento II.",
+                "MEMENTO II: same movie as Memento II.",
+                "Added 1 of 3 movies.",
+            ],
+        )
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(len(self.db_api.get_titles()), 101)
+
+    def test_add_many_missing_rating(self):
+        summary = self.commander.add_movies(["Gods II", "Memento II"])
+        self.assertTrue(summary.endswith("Added 2 of 2 movies."))
+        self.assertEqual(
+            self.db_api.select_one("SELECT IMDb_Rating FROM MOVIES WHERE TITLE='Gods II'"),
+            [(None,)],
+        )
+
+    def test_add_many_one_transaction(self):
+        with mock.patch.object(
+            self.db_api, "insert_one", side_effect=AssertionError
+        ), mock.patch.object(self.db_api, "insert_many", wraps=self.db_api.insert_many) as insert:
+            self.commander.add_movies(["Memento II", "In Bruges II"])
+        self.assertEqual(insert.call_count, 1)
+        self.assertEqual(len(insert.call_args.args[1]), 2)
+
+    def test_add_file(self):
+        with open(self.titles_fp, "w") as f:
+            f.write("Memento II\n\ntt9999998\n")
+        summary = self.commander.add_file(self.titles_fp)
+        self.assertTrue(summary.endswith("Added 2 of 2 movies."))
+        self.assertEqual(
+            self.commander.add_file("tests/nope.txt"),
+            "Can't read tests/nope.txt: No such file or directory.",
+        )
+
+
+def synthetic_movies(n):
+    """Fixture movies varied by index, with ties and missing values."""
+    fixture = load_fixture()
+    movies = []
+    for i in range(n):
+        movie = dict(fixture[i % len(fixture)], Title=f"Synthetic {i}")
+        movie["Year"] = str(1950 + i % 40)
+        movie["Runtime"] = f"{80 + i % 7 * 10} min" if i % 11 else "N/A"
+        movie["imdbRating"] = f"{5 + i % 9 * 0.5}"
+        movie["imdbVotes"] = f"{1000 * (i % 13):,}"
+        movie["BoxOffice"] = f"${1000000 * (i % 17):,}" if i % 3 else "N/A"
+        movie["Awards"] = f"Won {i % 3} Oscars. Another {i % 5} wins & {i % 8} nominations."
+        movies.append(movie)
+    return movies
+
+
+@unittest.skipUnless(importlib.util.find_spec("numpy"), "NumPy is not installed")
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.db_api.insert_many(query.insert(), req.rows(synthetic_movies(200)))
+        self.snapshot = analytics.Snapshot.load(self.db_api)
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def test_highscores_match_sql(self):
+        for top in (1, 3, 10):
+            self.assertEqual(
+                self.snapshot.highscores(top),
+                self.db_api.select_one(query.highscores(), (top,)),
+            )
+
+    def test_sort_matches_sql(self):
+        for args in [("votes",), ("year", "rating"), ("runtime", "title"), ("boxoffice", "awards", "year")]:
+            self.assertEqual(
+                self.snapshot.sort(*args), self.db_api.select_one(query.sort(*args))
+            )
+
+    def test_sort_by_text_column(self):
+        self.assertRaises(ValueError, self.snapshot.sort, "genre")
+
+    def test_percentiles_and_histogram(self):
+        years = sorted(row[0] for row in self.db_api.select_one("SELECT YEAR FROM MOVIES WHERE YEAR IS NOT NULL"))
+        self.assertEqual(self.snapshot.percentiles("year", [0, 100]), [(0, years[0]), (100, years[-1])])
+        histogram = self.snapshot.histogram("year", 4)
+        self.assertEqual(len(histogram), 4)
+        self.assertEqual(sum(count for _, _, count in histogram), len(years))
+
+    def test_commander_analytics_mode(self):
+        cmd = utils.Commander(output="records", query_cache_fp=None)
+        cmd._db_api = self.db_api
+        fast = utils.Commander(output="records", query_cache_fp=None, analytics=True)
+        fast._db_api = self.db_api
+        self.assertEqual(fast.highscores(2), cmd.highscores(2))
+        self.assertEqual(fast.sort_by("year", "votes"), cmd.sort_by("year", "votes"))
+        movie = dict(load_fixture()[0], Title="Longest", Runtime="999 min")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(fast.highscores()[0]["title"], "Longest")
+
+    def test_missing_numpy(self):
+        with mock.patch.dict(sys.modules, {"numpy": None}):
+            cmd = utils.Commander(query_cache_fp=None)
+            cmd._db_api = self.db_api
+            self.assertEqual(
+                cmd.percentiles("year"), "Analytics need NumPy, install it with: pip install numpy"
+            )
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.db_api.insert_many(query.insert(), req.rows(synthetic_movies(200)))
+        self.cmd = utils.Commander(output="records", query_cache_fp=None)
+        self.cmd._db_api = self.db_api
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def test_decades_match_python(self):
+        groups = {}
+        for id_, title, year, rating, boxoffice in self.db_api.select_one(
+            "SELECT ID, TITLE, YEAR, IMDb_Rating, BOX_OFFICE FROM MOVIES WHERE YEAR IS NOT NULL"
+        ):
+            groups.setdefault(f"{year // 10 * 10}s", []).append((id_, title, rating, boxoffice))
+        stats = self.cmd.stats("decade")
+        self.assertEqual([row["decade"] for row in stats], sorted(groups))
+        for row in stats:
+            movies = groups[row["decade"]]
+            ratings = [m[2] for m in movies if m[2] is not None]
+            best = min((m for m in movies if m[2] is not None), key=lambda m: (-m[2], m[0]))
+            self.assertEqual(row["movies"], str(len(movies)))
+            self.assertEqual(row["mean_rating"], str(round(sum(ratings) / len(ratings), 2)))
+            self.assertEqual(row["best_movie"], best[1])
+
+    def test_people_and_facets(self):
+        directors = self.cmd.stats("director")
+        self.assertEqual(len(directors), 5)
+        self.assertEqual(directors[0]["director"], "Christopher Nolan")
+        self.assertEqual(directors[0]["movies"], "41")
+        self.assertEqual(directors[2]["best_movie"], "The Shawshank Redemption")
+        genres = {row["genre"]: row for row in self.cmd.stats("genre", 50)}
+        self.assertEqual(set(genres), {"Drama", "Crime", "Thriller"})
+        self.assertEqual(genres["Drama"]["best_movie"], "The Shawshank Redemption")
+
+    def test_unknown_group(self):
+        self.assertTrue(self.cmd.stats("budget").startswith("You can't group by that: budget."))
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+        self.cmd = utils.Commander(output="records", query_cache_fp=None)
+        self.cmd._db_api = self.db_api
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def titles(self, *words):
+        rows = self.cmd.search(*words)
+        return [] if isinstance(rows, str) else [row["title"] for row in rows]
+
+    def test_match_expression(self):
+        self.assertEqual(query.match(["in bruges,", 'say "hi"', "godf*"]), '"in" "bruges," "say" """hi""" "godf"*')
+        self.assertRaises(ValueError, query.match, [" ", "*"])
+
+    def test_search_columns(self):
+        self.assertEqual(self.titles("Christopher", "Nolan"), ["Memento"])
+        self.assertEqual(self.titles("pacino"), ["The Godfather"])
+        self.assertEqual(self.titles("crime", "drama", "godf*"), ["The Godfather"])
+        self.assertEqual(self.cmd.search("spaceship"), "No movie match these words.")
+
+    def test_title_ranked_first(self):
+        movie = dict(load_fixture()[1], Title="Nolan", Director="Someone Else")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(self.titles("nolan"), ["Nolan", "Memento"])
+
+    def test_index_follows_writes(self):
+        movie = dict(load_fixture()[1], Director="Someone Else", Writer="Someone Else")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(self.titles("nolan"), [])
+        self.assertEqual(self.titles("someone"), ["Memento"])
+        with self.db_api.writer() as con:
+            con.execute("DELETE FROM MOVIES WHERE TITLE='Memento'")
+        self.assertEqual(self.titles("someone"), [])
+        self.db_api.con.execute("INSERT INTO MOVIES_FTS (MOVIES_FTS) VALUES ('integrity-check')")
+
+
+    def test_unpopulated_rows_printed(self):
+        cmd = utils.Commander(query_cache_fp=None)
+        cmd._db_api = self.db_api
+        cmd._printer = utils.DataPrinter(interactive=False)
+        table = cmd.search("heat")
+        self.assertIn("Heat", table)
+        self.assertIn("N/A", table)
+
+
+class TestTitleResolution(unittest.TestCase):
+    def setUp(self):
+        os.system("cp tests/test.db tests/tmp.db")
+        self.db_api = dbm.DatabaseManager(tests=True)
+        self.db_api.insert_many(query.update(), req.rotated_rows(load_fixture()))
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm tests/tmp.db")
+
+    def test_similarity(self):
+        self.assertEqual(tools.similarity("heat", "heat"), 1)
+        self.assertEqual(tools.similarity("heat", "xyz"), 0)
+        self.assertGreater(tools.similarity("godfather", "the godfather"), 0.5)
+
+    def test_exact_and_fuzzy(self):
+        self.assertEqual(self.db_api.find_title("MEMENTO"), (1, "Memento"))
+        self.assertEqual(self.db_api.find_title("godfather"), (4, "The Godfather"))
+        self.assertEqual(self.db_api.find_title("the shawshenk redemption")[1], "The Shawshank Redemption")
+        self.assertIsNone(self.db_api.find_title("godfather", fuzzy=False))
+        self.assertIsNone(self.db_api.find_title("zzzz"))
+        self.assertRaises(ValueError, self.db_api.resolve_title, "qq")
+
+    def test_index_follows_writes(self):
+        movie = dict(load_fixture()[0], Title="Heat")
+        self.db_api.insert_one(query.insert(), req.row(movie))
+        self.assertEqual(self.db_api.find_title("heats")[1], "Heat")
+        with self.db_api.writer() as con:
+            con.execute("DELETE FROM MOVIES WHERE TITLE='Heat'")
+        self.assertIsNone(self.db_api.find_title("heat"))
+
+    def test_candidates_use_index(self):
+        plan = self.db_api.select_one(
+            "EXPLAIN QUERY PLAN " + query.title_candidates(2),
+            (query.trigram_match(["hea"]), 5, "hea", "eat"),
+        )
+        self.assertIn("TITLES_TRIGRAM VIRTUAL TABLE INDEX", " ".join(row[-1] for row in plan))
+
+    def test_commander_resolves_titles(self):
+        cmd = offline_commander(self.db_api, "http://127.0.0.1:9")
+        cmd.output = "records"
+        self.assertEqual(
+            cmd.compare("imdb", "godfather", "in brugs"), [{"title": "The Godfather", "imdb": "9.2"}]
+        )
+        self.assertEqual(cmd.compare("imdb", "memento", "nothing at all"), "Error: Movie not in DB: nothing at all.")
+        self.assertEqual(cmd.add_movie("in bruges"), "Error: Movie is in DB as In Bruges.")
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.db_api = catalog.generate("tests/tmp_catalog.sqlite", 300)
+
+    def tearDown(self):
+        self.db_api.close()
+        os.system("rm -rf tests/tmp_catalog.sqlite* tests/tmp_catalogs")
+
+    def test_catalog(self):
+        self.assertEqual(self.db_api.select_one("SELECT COUNT(DISTINCT TITLE_KEY) FROM MOVIES"), [(300,)])
+        self.assertEqual(
+            self.db_api.select_one("SELECT COUNT(*) FROM MOVIES WHERE AWARDS!='N/A' AND AWARDS_WON IS NULL"),
+            [(0,)],
         )
+        self.assertTrue(self.db_api.select_one("SELECT COUNT(*) FROM MOVIES WHERE OSCARS_NOM>0")[0][0])
+        self.assertTrue(self.db_api.select_one("SELECT COUNT(*) FROM MOVIE_PEOPLE")[0][0])
+        self.assertEqual(self.db_api.meta("catalog"), "300:0")
+        self.assertEqual(list(catalog.records(3)), list(catalog.records(3)))
+        self.assertEqual(len({catalog.person(i) for i in range(5000)}), 5000)
+
+    def test_catalog_reused(self):
+        filepath = catalog.catalog(50, data_dir="tests/tmp_catalogs")
+        mtime = os.path.getmtime(filepath)
+        self.assertEqual(catalog.catalog(50, data_dir="tests/tmp_catalogs"), filepath)
+        self.assertEqual(os.path.getmtime(filepath), mtime)
+
+    def test_stub_takes_generator(self):
+        stub = StubOMDb(catalog.records(3))
+        self.assertEqual(stub.movies["tt0000002"]["Title"], catalog.title(2))
+        stub.server_close()
+
+    def test_title_scan_bounded(self):
+        grams = query.key_trigrams(tools.name_key(catalog.title(7)))
+        docs = dict(self.db_api.select_one(query.QUERY["trigram_docs"], (json.dumps(grams),)))
+        self.assertGreater(sum(docs.values()), 20)
+        scanned = []
+        self.db_api.con.set_trace_callback(scanned.append)
+        with mock.patch.object(dbm, "TITLE_SCAN", 20):
+            self.assertEqual(self.db_api.find_title(catalog.title(7)[:-1] + "x")[1], catalog.title(7))
+        self.db_api.con.set_trace_callback(None)
+        match = next(sql for sql in scanned if "TITLES_TRIGRAM MATCH" in sql)
+        counts = sorted(docs[gram] for gram in grams if f'"{gram}"' in match)
+        self.assertLess(len(counts), len(grams))
+        self.assertLess(sum(counts[:-1]), 20)
+
+    def test_every_function_timed(self):
+        self.assertEqual(set(hot_paths.UDF_ARGS), set(FUNCMAP))
+
+    def test_run(self):
+        with mock.patch.multiple(hot_paths, REQUESTS=10, ADD_BATCH=5, IMPORT_ROWS=20):
+            results = dict(hot_paths.run("tests/tmp_catalog.sqlite", 300, 1))
+        for name in ["sort_by", "filter_by", "compare", "highscores", "search", "stats", "add_movie", "add_movies", "import_movies", "refresh"]:
+            self.assertTrue(any(key.startswith(f"commander.{name}.") or key == f"commander.{name}" for key in results))
+        self.assertIn("printer.fold.wide", results)
+        self.assertIn("requester.request_many", results)
+        self.assertEqual({len(timings) for timings in results.values()}, {1})
+        times = {(name, 300): min(timings) for name, timings in results.items()}
+        self.assertFalse([row for row in bench_compare.compare(times, times) if row[-1]])
+        slower = {key: value * 2 + 0.01 for key, value in times.items()}
+        self.assertTrue(all(row[-1] for row in bench_compare.compare(times, slower)))